@@ -0,0 +1,264 @@
+import json
+import sqlite3
+import threading
+import time
+
+from seen_messages import SeenMessages
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    email TEXT PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    creds TEXT NOT NULL,
+    otp_count INTEGER NOT NULL DEFAULT 0,
+    history_id TEXT,
+    seen TEXT NOT NULL DEFAULT '[]',
+    recent_otps TEXT NOT NULL DEFAULT '[]',
+    checked_at REAL NOT NULL DEFAULT 0,
+    connected_at REAL NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS accounts_chat_id ON accounts (chat_id);
+CREATE TABLE IF NOT EXISTS poll_requests (
+    email TEXT PRIMARY KEY,
+    boost INTEGER NOT NULL DEFAULT 0,
+    requested_at REAL NOT NULL
+);
+"""
+# Columns added since the table was first created, for older databases.
+ADDED_COLUMNS = {
+    "recent_otps": "TEXT NOT NULL DEFAULT '[]'",
+    "checked_at": "REAL NOT NULL DEFAULT 0",
+    "connected_at": "REAL NOT NULL DEFAULT 0",
+}
+ACCOUNT_COLUMNS = "chat_id, creds, otp_count, history_id, seen, recent_otps, checked_at, connected_at"
+
+class AccountStore:
+    # Accounts live in memory, indexed by email and by chat_id, and are backed by
+    # SQLite. Connects, logouts and credential changes are written straight away;
+    # seen/otp_count/history_id/recent_otps updates are only marked dirty and
+    # written in batches by flush().
+    def __init__(self, path, flush_interval=5, seen_window_seconds=7200):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.seen_window_seconds = seen_window_seconds
+        self._accounts = {}
+        self._by_chat = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._thread = None
+        # Poll worker processes share this file, so wait out their write locks.
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(accounts)")}
+        for name, definition in ADDED_COLUMNS.items():
+            if name not in columns:
+                self._db.execute(f"ALTER TABLE accounts ADD COLUMN {name} {definition}")
+
+    def _row_to_account(self, chat_id, otp_count, history_id, seen, recent_otps, checked_at, connected_at):
+        return {
+            "chat_id": chat_id,
+            "seen": SeenMessages.from_list(json.loads(seen), window_seconds=self.seen_window_seconds),
+            "otp_count": otp_count,
+            "history_id": history_id,
+            "recent_otps": json.loads(recent_otps),
+            "checked_at": checked_at,
+            "connected_at": connected_at,
+        }
+
+    def _unindex_chat(self, email):
+        # The same Gmail reconnected from another chat mustn't stay reachable from the old one.
+        data = self._accounts.get(email)
+        if data is not None and self._by_chat.get(data["chat_id"]) == email:
+            del self._by_chat[data["chat_id"]]
+
+    def load(self):
+        with self._db_lock:
+            rows = self._db.execute(f"SELECT email, {ACCOUNT_COLUMNS} FROM accounts").fetchall()
+        creds = {}
+        with self._lock:
+            for email, chat_id, creds_json, *state in rows:
+                self._accounts[email] = self._row_to_account(chat_id, *state)
+                self._by_chat[chat_id] = email
+                creds[email] = json.loads(creds_json)
+        return creds
+
+    def refresh(self):
+        # Lists which accounts exist without loading them, so a poll worker only
+        # holds the accounts it has adopted with reload(). Returns every email in
+        # the table, plus which of the accounts in memory were logged out or
+        # connected again since they were loaded.
+        with self._db_lock:
+            rows = self._db.execute("SELECT email, connected_at FROM accounts").fetchall()
+        listed = []
+        reconnected = []
+        with self._lock:
+            for email, connected_at in rows:
+                listed.append(email)
+                data = self._accounts.get(email)
+                if data is not None and connected_at > data["connected_at"]:
+                    reconnected.append(email)
+            current = set(listed)
+            removed = [email for email in self._accounts if email not in current]
+            for email in removed:
+                self._evict(email)
+        return listed, removed, reconnected
+
+    def reload(self, email):
+        with self._db_lock:
+            row = self._db.execute(f"SELECT {ACCOUNT_COLUMNS} FROM accounts WHERE email = ?", (email,)).fetchone()
+        if row is None:
+            return None, None
+        chat_id, creds_json, *state = row
+        data = self._row_to_account(chat_id, *state)
+        with self._lock:
+            self._unindex_chat(email)
+            self._accounts[email] = data
+            self._by_chat[chat_id] = email
+            self._dirty.discard(email)
+        return data, json.loads(creds_json)
+
+    def queue_poll_request(self, email, boost=False):
+        with self._db_lock:
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO poll_requests (email, boost, requested_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(email) DO UPDATE SET boost = MAX(boost, excluded.boost), "
+                    "requested_at = excluded.requested_at",
+                    (email, int(boost), time.time())
+                )
+
+    def take_poll_requests(self, owns):
+        with self._db_lock:
+            with self._db:
+                rows = self._db.execute("SELECT email, boost, requested_at FROM poll_requests").fetchall()
+                taken = [row for row in rows if owns(row[0])]
+                # Match requested_at too, so a request queued again meanwhile isn't lost.
+                self._db.executemany(
+                    "DELETE FROM poll_requests WHERE email = ? AND requested_at = ?",
+                    [(email, requested_at) for email, _, requested_at in taken]
+                )
+        return [(email, bool(boost)) for email, boost, _ in taken]
+
+    def add(self, email, chat_id, creds_dict):
+        chat_id = str(chat_id)
+        data = {
+            "chat_id": chat_id,
+            "seen": SeenMessages(window_seconds=self.seen_window_seconds),
+            "otp_count": 0,
+            "history_id": None,
+            "recent_otps": [],
+            "checked_at": 0.0,
+            "connected_at": time.time(),
+        }
+        with self._lock:
+            # One Gmail account per chat: connecting another replaces the old one.
+            previous = self._by_chat.get(chat_id)
+            if previous and previous != email:
+                self._accounts.pop(previous, None)
+                self._dirty.discard(previous)
+            self._unindex_chat(email)
+            self._accounts[email] = data
+            self._by_chat[chat_id] = email
+            self._dirty.discard(email)
+        with self._db_lock:
+            with self._db:
+                if previous and previous != email:
+                    self._db.execute("DELETE FROM accounts WHERE email = ?", (previous,))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO accounts "
+                    "(email, chat_id, creds, otp_count, history_id, seen, connected_at, updated_at) "
+                    "VALUES (?, ?, ?, 0, NULL, '[]', ?, ?)",
+                    (email, chat_id, json.dumps(creds_dict), data["connected_at"], time.time())
+                )
+        return previous if previous != email else None
+
+    def remove(self, email):
+        with self._lock:
+            data = self._accounts.get(email)
+            self._evict(email)
+        with self._db_lock:
+            with self._db:
+                self._db.execute("DELETE FROM accounts WHERE email = ?", (email,))
+        return data
+
+    def evict(self, email):
+        # Forget an account in memory only, e.g. when its shard moves to another worker.
+        with self._lock:
+            self._evict(email)
+
+    def _evict(self, email):
+        self._unindex_chat(email)
+        self._accounts.pop(email, None)
+        self._dirty.discard(email)
+
+    def get(self, email):
+        return self._accounts.get(email)
+
+    def get_by_chat_id(self, chat_id):
+        email = self._by_chat.get(str(chat_id))
+        if email is None:
+            return None, None
+        data = self._accounts.get(email)
+        return (email, data) if data is not None else (None, None)
+
+    def items(self):
+        with self._lock:
+            return list(self._accounts.items())
+
+    def __contains__(self, email):
+        return email in self._accounts
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def update_creds(self, email, creds_dict):
+        with self._db_lock:
+            with self._db:
+                self._db.execute(
+                    "UPDATE accounts SET creds = ?, updated_at = ? WHERE email = ?",
+                    (json.dumps(creds_dict), time.time(), email)
+                )
+
+    def mark_dirty(self, email):
+        with self._lock:
+            if email in self._accounts:
+                self._dirty.add(email)
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = []
+            now = time.time()
+            for email in dirty:
+                data = self._accounts.get(email)
+                if data is not None:
+                    seen = json.dumps(data["seen"].to_list())
+                    recent_otps = json.dumps(data["recent_otps"])
+                    rows.append((data["otp_count"], data["history_id"], seen, recent_otps, data["checked_at"], now, email))
+        if not rows:
+            return 0
+        with self._db_lock:
+            with self._db:
+                self._db.executemany(
+                    "UPDATE accounts SET otp_count = ?, history_id = ?, seen = ?, recent_otps = ?, checked_at = ?, "
+                    "updated_at = ? WHERE email = ?",
+                    rows
+                )
+        return len(rows)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="account-flush")
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Account store flush error: {e}")
@@ -0,0 +1,340 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FILE = os.path.join(BENCH_DIR, "load_results.jsonl")
+COMPARE_KEYS = ("accounts", "otp_rate", "noise_rate", "gmail_latency_ms", "telegram_latency_ms",
+                "gmail_error_rate", "telegram_error_rate", "poll_workers")
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_services import account_chat_id, account_email, account_token, percentiles
+
+# Runs the bot's real poller, dispatcher and button handler against the fakes
+# in fake_services.py (started as a separate process so they don't share our
+# GIL), then reports poll throughput, OTP latency, API calls per OTP and memory
+# per account, and appends the numbers to load_results.jsonl.
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def fetch_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/_stats", timeout=10) as response:
+        return json.load(response)
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+def start_fakes(args, port):
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, "fake_services.py"),
+        "--port", str(port),
+        "--accounts", str(args.accounts),
+        "--otp-rate", str(args.otp_rate),
+        "--noise-rate", str(args.noise_rate),
+        "--body-only", str(args.body_only),
+        "--gmail-latency-ms", str(args.gmail_latency_ms),
+        "--gmail-error-rate", str(args.gmail_error_rate),
+        "--telegram-latency-ms", str(args.telegram_latency_ms),
+        "--telegram-error-rate", str(args.telegram_error_rate),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            fetch_stats(base_url)
+            return process, base_url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("fake services did not come up")
+
+def write_discovery(base_url, workdir):
+    from googleapiclient.discovery_cache import get_static_doc
+    doc = json.loads(get_static_doc("gmail", "v1"))
+    doc["rootUrl"] = doc["baseUrl"] = doc["mtlsRootUrl"] = f"{base_url}/"
+    path = os.path.join(workdir, "gmail.json")
+    with open(path, "w") as f:
+        json.dump(doc, f)
+    return path
+
+def seed_accounts(path, count, base_url):
+    from account_store import AccountStore
+    store = AccountStore(path)
+    expiry = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(time.time() + 3600))
+    for index in range(count):
+        store.add(account_email(index), account_chat_id(index), {
+            "token": account_token(index),
+            "refresh_token": f"bench-refresh-{index}",
+            "token_uri": f"{base_url}/token",
+            "client_id": "bench",
+            "client_secret": "bench",
+            "scopes": ["https://www.googleapis.com/auth/gmail.modify"],
+            "expiry": expiry,
+        })
+
+def callback_update(bot, chat_id, data, update_id):
+    from telegram import Update
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }, bot)
+
+def button_chat_id(main, args):
+    if args.button_target == "otp":
+        # Someone expecting a code taps the button after it was (or should have been) sent.
+        emails = [email for email, data in main.ACCOUNTS.items() if data.get("otp_count")]
+        if emails:
+            return main.ACCOUNTS.get(random.choice(emails))["chat_id"]
+    return account_chat_id(random.randrange(args.accounts))
+
+def press_buttons(main, args, stop, timings):
+    # Bursts of concurrent "Check Latest OTP" presses spread over the run.
+    bursts = max(1, args.button_presses // args.button_concurrency)
+    gap = args.duration / (bursts + 1)
+    update_id = 0
+    for _ in range(bursts):
+        if stop.wait(gap):
+            return
+        futures = []
+        for _ in range(args.button_concurrency):
+            update_id += 1
+            chat_id = button_chat_id(main, args)
+            update = callback_update(main.telegram_app.bot, chat_id, "refresh_otp", update_id)
+            started = time.monotonic()
+            future = asyncio.run_coroutine_threadsafe(main.button(update, None), main.telegram_loop)
+            futures.append((started, future))
+        for started, future in futures:
+            try:
+                future.result(timeout=60)
+                timings.append(time.monotonic() - started)
+            except Exception as e:
+                print(f"Button press failed: {e}")
+
+def button_gmail_lookups(main):
+    return dict(main.RECENT_OTP_LOOKUPS.samples()).get(("gmail",), 0)
+
+async def watch_loop_lag(samples, interval=0.05):
+    # How late the bot loop wakes up; anything blocking it delays every chat.
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        samples.append(time.monotonic() - started - interval)
+
+def previous_result(path, params):
+    if not os.path.exists(path):
+        return None
+    match = None
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if all(entry["params"].get(key) == params.get(key) for key in COMPARE_KEYS):
+                match = entry
+    return match
+
+def print_report(metrics, previous):
+    rows = [
+        ("first sweep (s)", "first_sweep_seconds", "lower"),
+        ("polls/sec", "polls_per_second", "higher"),
+        ("mean poll interval (s)", "mean_poll_interval_seconds", "lower"),
+        ("max schedule lag (s)", "max_schedule_lag_seconds", "lower"),
+        ("OTPs delivered", "otps_delivered", None),
+        ("OTP latency p50 (s)", "otp_latency_p50", "lower"),
+        ("OTP latency p90 (s)", "otp_latency_p90", "lower"),
+        ("OTP latency p99 (s)", "otp_latency_p99", "lower"),
+        ("Gmail calls / OTP", "gmail_calls_per_otp", "lower"),
+        ("Gmail HTTP requests / OTP", "gmail_http_per_otp", "lower"),
+        ("Telegram calls / OTP", "telegram_calls_per_otp", "lower"),
+        ("button p50 (s)", "button_p50", "lower"),
+        ("button max (s)", "button_max", "lower"),
+        ("button Gmail lookups", "button_gmail_lookups", "lower"),
+        ("bot loop lag max (s)", "loop_lag_max", "lower"),
+        ("memory / account (KB)", "memory_per_account_kb", "lower"),
+        ("RSS (MB)", "rss_mb", "lower"),
+    ]
+    if previous:
+        print(f"\nCompared with {previous['revision']} from {previous['timestamp']}:")
+    for label, key, better in rows:
+        value = metrics.get(key, 0)
+        line = f"  {label:28} {value:12.3f}"
+        if previous and key in previous["metrics"] and better:
+            old = previous["metrics"][key]
+            if old:
+                change = (value - old) / old
+                worse = change > 0.1 if better == "lower" else change < -0.1
+                line += f"   {change:+7.1%} vs {old:.3f}{'  ⚠️ regression' if worse else ''}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the poller, dispatcher and buttons against fake Gmail/Telegram")
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run after startup")
+    parser.add_argument("--otp-rate", type=float, default=0.2, help="OTP mails per account per minute")
+    parser.add_argument("--noise-rate", type=float, default=0.5, help="other mails per account per minute")
+    parser.add_argument("--body-only", type=float, default=0.1, help="share of OTP mails with the code only in the body")
+    parser.add_argument("--gmail-latency-ms", type=float, default=40)
+    parser.add_argument("--gmail-error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency-ms", type=float, default=30)
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0)
+    parser.add_argument("--poll-workers", type=int, default=32)
+    parser.add_argument("--button-presses", type=int, default=20)
+    parser.add_argument("--button-concurrency", type=int, default=5)
+    parser.add_argument("--button-target", choices=("any", "otp"), default="any",
+                        help="press for random chats, or for chats that have been sent an OTP")
+    parser.add_argument("--results", default=RESULTS_FILE)
+    parser.add_argument("--label", default="", help="free-form note stored with the result")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="otp-bench-") as workdir:
+        fakes, base_url = start_fakes(args, free_port())
+        try:
+            db_path = os.path.join(workdir, "accounts.db")
+            seed_accounts(db_path, args.accounts, base_url)
+            os.environ.update({
+                "ACCOUNTS_DB": db_path,
+                "DELETE_JOURNAL": os.path.join(workdir, "pending_deletes.log"),
+                "STATE_SNAPSHOT": os.path.join(workdir, "state_snapshot.json"),
+                "GMAIL_DISCOVERY_FILE": write_discovery(base_url, workdir),
+                "TELEGRAM_BOT_TOKEN": "123456:bench",
+                "TELEGRAM_API_URL": base_url,
+                "POLL_WORKERS": str(args.poll_workers),
+            })
+            os.environ.pop("GMAIL_PUSH_TOPIC", None)
+
+            import main
+            rss_before = rss_mb()
+            main.GMAIL_DISCOVERY_DOC = main.load_gmail_discovery()
+            main.restore_accounts()
+            main.ACCOUNTS.start()
+            main.CREDENTIALS.start()
+            main.start_telegram(handle_updates=False)
+            deadline = time.monotonic() + 15
+            while main.telegram_app.bot._bot_user is None and time.monotonic() < deadline:
+                time.sleep(0.05)
+
+            loop_lag = []
+            asyncio.run_coroutine_threadsafe(watch_loop_lag(loop_lag), main.telegram_loop)
+            started = time.monotonic()
+            main.start_poll()
+
+            stop = threading.Event()
+            button_timings = []
+            buttons = threading.Thread(target=press_buttons, args=(main, args, stop, button_timings), daemon=True)
+            buttons.start()
+
+            first_sweep = None
+            max_lag = 0.0
+            rss_peak = rss_mb()
+            while time.monotonic() - started < args.duration:
+                time.sleep(0.5)
+                max_lag = max(max_lag, main.POLL_STATS["max_lag_seconds"])
+                rss_peak = max(rss_peak, rss_mb())
+                if first_sweep is None and main.POLL_STATS["polls"] >= args.accounts:
+                    first_sweep = time.monotonic() - started
+            elapsed = time.monotonic() - started
+            stop.set()
+            buttons.join(timeout=60)
+            polls = main.POLL_STATS["polls"]
+            fake_stats = fetch_stats(base_url)
+        finally:
+            fakes.terminate()
+
+    delivered = fake_stats["otps_delivered"]
+    latency = fake_stats["otp_latency"]
+    buttons_summary = percentiles(button_timings)
+    polls_per_second = polls / elapsed if elapsed else 0.0
+    metrics = {
+        "first_sweep_seconds": first_sweep if first_sweep is not None else elapsed,
+        "polls": polls,
+        "polls_per_second": polls_per_second,
+        "mean_poll_interval_seconds": args.accounts / polls_per_second if polls_per_second else 0.0,
+        "max_schedule_lag_seconds": max_lag,
+        "otps_injected": fake_stats["otps_injected"],
+        "otps_delivered": delivered,
+        "otps_pending": fake_stats["otps_pending"],
+        "otp_latency_p50": latency["p50"],
+        "otp_latency_p90": latency["p90"],
+        "otp_latency_p99": latency["p99"],
+        "otp_latency_max": latency["max"],
+        "gmail_calls": fake_stats["gmail_calls"],
+        "gmail_http_requests": fake_stats["gmail_http_requests"],
+        "gmail_calls_per_otp": fake_stats["gmail_calls"] / delivered if delivered else 0.0,
+        "gmail_http_per_otp": fake_stats["gmail_http_requests"] / delivered if delivered else 0.0,
+        "telegram_calls_per_otp": fake_stats["telegram_calls"] / delivered if delivered else 0.0,
+        "button_p50": buttons_summary["p50"],
+        "button_p90": buttons_summary["p90"],
+        "button_max": buttons_summary["max"],
+        "button_gmail_lookups": button_gmail_lookups(main),
+        "loop_lag_max": max(loop_lag) if loop_lag else 0.0,
+        "rss_mb": rss_peak,
+        "memory_per_account_kb": (rss_peak - rss_before) * 1024 / args.accounts,
+    }
+    params = {key: value for key, value in vars(args).items() if key not in ("results", "label", "no_save")}
+
+    print(f"\n{args.accounts} accounts, {elapsed:.0f}s, {polls} polls, "
+          f"{delivered}/{fake_stats['otps_injected']} OTPs delivered")
+    print(f"Gmail calls: {fake_stats['gmail_methods']}")
+    print(f"Telegram calls: {fake_stats['telegram_methods']}")
+    print_report(metrics, previous_result(args.results, params))
+
+    if not args.no_save:
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "revision": git_revision(),
+            "label": args.label,
+            "params": params,
+            "metrics": metrics,
+        }
+        with open(args.results, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        print(f"\nSaved to {args.results}")
+
+    sys.stdout.flush()
+    # Poll workers, the bot loop and the flusher are daemon threads mid-request; don't wait on them.
+    os._exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import base64
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from otp_extractor import extract_otp
+
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "otp_corpus.jsonl")
+LEGACY_REGEX = re.compile(r"\b(\d{4,8})\b")
+
+def encode(text):
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii").rstrip("=")
+
+def load_corpus(path):
+    samples = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            parts = []
+            if "body_plain" in entry:
+                parts.append({"mimeType": "text/plain", "body": {"data": encode(entry["body_plain"])}})
+            if "body_html" in entry:
+                parts.append({"mimeType": "text/html", "body": {"data": encode(entry["body_html"])}})
+            entry["payload"] = {"mimeType": "multipart/alternative", "parts": parts} if parts else None
+            samples.append(entry)
+    return samples
+
+def legacy_extract(sample):
+    otps = LEGACY_REGEX.findall(sample["snippet"])
+    return otps[0] if otps else None
+
+def current_extract(sample):
+    return extract_otp(sample["subject"], sample["snippet"], sample["payload"])
+
+def accuracy(samples, extractor, verbose=False):
+    correct = 0
+    for sample in samples:
+        got = extractor(sample)
+        if got == sample["expected"]:
+            correct += 1
+        elif verbose:
+            print(f"  miss: {sample['subject']!r} -> {got!r} (expected {sample['expected']!r})")
+    return correct / len(samples)
+
+def throughput(samples, extractor, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for sample in samples:
+            extractor(sample)
+    elapsed = time.perf_counter() - started
+    return iterations * len(samples) / elapsed
+
+def marketing_sample(size_kb):
+    block = "<tr><td style='padding:8px'>Deal of the day - save 30% on 2000+ items, from $19.99</td></tr>"
+    markup = "<html><body><table>" + block * (size_kb * 1024 // len(block)) + "</table></body></html>"
+    return {
+        "subject": "Your weekly deals",
+        "snippet": "Deal of the day - save 30% on 2000+ items",
+        "payload": {"mimeType": "text/html", "body": {"data": encode(markup)}},
+        "expected": None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="OTP extractor accuracy and throughput")
+    parser.add_argument("--corpus", default=CORPUS_FILE)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    samples = load_corpus(args.corpus)
+    print(f"Corpus: {len(samples)} labelled messages")
+    for name, extractor in (("legacy snippet regex", legacy_extract), ("otp_extractor", current_extract)):
+        acc = accuracy(samples, extractor, verbose=args.verbose and extractor is current_extract)
+        rate = throughput(samples, extractor, args.iterations)
+        print(f"{name:22} accuracy {acc:6.1%}   {rate:10,.0f} msgs/sec")
+
+    large = [marketing_sample(200)]
+    rate = throughput(large, current_extract, max(1, args.iterations // 20))
+    print(f"{'200 KB marketing HTML':22} {'':15}   {rate:10,.0f} msgs/sec")
+
+if __name__ == "__main__":
+    main()
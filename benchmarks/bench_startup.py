@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_load import ROOT, fetch_stats, free_port, git_revision, seed_accounts, start_fakes, write_discovery
+
+RESULTS_FILE = os.path.join(BENCH_DIR, "startup_results.jsonl")
+MODES = {"fast": "1", "classic": "0"}
+
+# Starts `python main.py` against the fakes in fake_services.py, the way Render
+# cold-starts it, and times how long until / answers, the bot reaches Telegram
+# and the first Gmail poll goes out. Each mode's first run starts without a
+# state snapshot; the later runs restore the one the previous run saved at
+# SIGTERM. Numbers are appended to startup_results.jsonl.
+
+def http_ok(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+def telegram_started(stats, before):
+    methods, old = stats["telegram_methods"], before["telegram_methods"]
+    return any(methods.get(name, 0) > old.get(name, 0) for name in ("getUpdates", "setWebhook"))
+
+def run_once(args, base_url, env, log_path):
+    port = free_port()
+    env = dict(env, PORT=str(port))
+    before = fetch_stats(base_url)
+    timings = {"first_request": None, "bot_started": None, "first_poll": None}
+    with open(log_path, "w") as log:
+        started = time.monotonic()
+        process = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            while None in timings.values() and time.monotonic() - started < args.timeout:
+                if process.poll() is not None:
+                    raise RuntimeError(f"main.py exited with code {process.returncode}, see {log_path}")
+                if timings["first_request"] is None and http_ok(f"http://127.0.0.1:{port}/"):
+                    timings["first_request"] = time.monotonic() - started
+                stats = fetch_stats(base_url)
+                if timings["bot_started"] is None and telegram_started(stats, before):
+                    timings["bot_started"] = time.monotonic() - started
+                if timings["first_poll"] is None and stats["gmail_calls"] > before["gmail_calls"]:
+                    timings["first_poll"] = time.monotonic() - started
+                time.sleep(0.005)
+            # Let it run a little so the snapshot it saves on the way out has settled tiers.
+            time.sleep(args.settle)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    with open(log_path) as f:
+        timings["snapshot_restored"] = any("restored from a" in line for line in f)
+    return timings
+
+def median(values):
+    values = [value for value in values if value is not None]
+    return statistics.median(values) if values else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Time main.py's cold start against fake Gmail/Telegram")
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=3, help="starts per mode; the first has no snapshot")
+    parser.add_argument("--modes", default="classic,fast", help=f"comma-separated, from {', '.join(MODES)}")
+    parser.add_argument("--server-mode", choices=("threaded", "asgi"), default="threaded")
+    parser.add_argument("--gmail-latency-ms", type=float, default=40)
+    parser.add_argument("--telegram-latency-ms", type=float, default=30)
+    parser.add_argument("--timeout", type=float, default=60, help="give up on a start after this many seconds")
+    parser.add_argument("--settle", type=float, default=2, help="seconds to keep running after the first poll")
+    parser.add_argument("--results", default=RESULTS_FILE)
+    parser.add_argument("--label", default="", help="free-form note stored with the result")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+    # Mail traffic doesn't matter for startup; start_fakes wants the knobs anyway.
+    args.otp_rate = args.noise_rate = args.body_only = 0.0
+    args.gmail_error_rate = args.telegram_error_rate = 0.0
+
+    with tempfile.TemporaryDirectory(prefix="otp-startup-") as workdir:
+        fakes, base_url = start_fakes(args, free_port())
+        results = {}
+        try:
+            base_env = dict(os.environ)
+            for name in ("GMAIL_PUSH_TOPIC", "RENDER", "SERVICE_ROLE", "POLL_PROCESSES"):
+                base_env.pop(name, None)
+            base_env.update({
+                "GMAIL_DISCOVERY_FILE": write_discovery(base_url, workdir),
+                "TELEGRAM_BOT_TOKEN": "123456:bench",
+                "TELEGRAM_API_URL": base_url,
+                "SERVER_MODE": args.server_mode,
+                "PYTHONUNBUFFERED": "1",
+            })
+            for mode in args.modes.split(","):
+                mode_dir = os.path.join(workdir, mode)
+                os.makedirs(mode_dir)
+                db_path = os.path.join(mode_dir, "accounts.db")
+                seed_accounts(db_path, args.accounts, base_url)
+                env = dict(base_env, **{
+                    "FAST_START": MODES[mode],
+                    "ACCOUNTS_DB": db_path,
+                    "DELETE_JOURNAL": os.path.join(mode_dir, "pending_deletes.log"),
+                    "STATE_SNAPSHOT": os.path.join(mode_dir, "state_snapshot.json"),
+                })
+                runs = []
+                for run in range(args.runs):
+                    timings = run_once(args, base_url, env, os.path.join(mode_dir, f"run-{run}.log"))
+                    runs.append(timings)
+                    print(f"{mode:8} run {run}: / {timings['first_request'] or float('nan'):.3f}s, "
+                          f"bot {timings['bot_started'] or float('nan'):.3f}s, "
+                          f"first poll {timings['first_poll'] or float('nan'):.3f}s"
+                          f"{', snapshot restored' if timings['snapshot_restored'] else ''}")
+                results[mode] = {
+                    "first_request_seconds": median(run["first_request"] for run in runs),
+                    "bot_started_seconds": median(run["bot_started"] for run in runs),
+                    "first_poll_seconds": median(run["first_poll"] for run in runs),
+                    "first_poll_cold_seconds": runs[0]["first_poll"],
+                    "runs": runs,
+                }
+        finally:
+            fakes.terminate()
+
+    print(f"\n{args.accounts} accounts, {args.server_mode} server, median of {args.runs} starts:")
+    print(f"  {'mode':10} {'first request (s)':>18} {'bot started (s)':>16} {'first poll (s)':>15}")
+    for mode, result in results.items():
+        cells = [result[key] for key in ("first_request_seconds", "bot_started_seconds", "first_poll_seconds")]
+        print(f"  {mode:10} " + " ".join(f"{'-' if v is None else f'{v:.3f}':>{w}}" for v, w in zip(cells, (18, 16, 15))))
+
+    if not args.no_save:
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "revision": git_revision(),
+            "label": args.label,
+            "params": {key: value for key, value in vars(args).items() if key not in ("results", "label", "no_save")},
+            "metrics": results,
+        }
+        with open(args.results, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        print(f"\nSaved to {args.results}")
+
+if __name__ == "__main__":
+    main()
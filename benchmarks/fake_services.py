@@ -0,0 +1,420 @@
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-ins for the Gmail API and the Telegram Bot API, for load tests.
+# Account i is bench<i>@example.com, authenticates as bench-token-<i> and is
+# connected to chat 100000 + i. A traffic thread drops OTP and newsletter mail
+# into random inboxes; every code that later turns up in a sendMessage is
+# matched back to its mail to measure end-to-end latency.
+
+CHAT_BASE = 100000
+HISTORY_KEEP = 500
+CODE_REGEX = re.compile(r"`([A-Za-z0-9-]{4,10})`")
+
+def account_email(index):
+    return f"bench{index}@example.com"
+
+def account_token(index):
+    return f"bench-token-{index}"
+
+def account_chat_id(index):
+    return CHAT_BASE + index
+
+def encode(text):
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii").rstrip("=")
+
+def percentiles(values):
+    if not values:
+        return {"count": 0, "p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"count": len(values), "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": values[-1]}
+
+def gmail_method_name(resource):
+    if resource == ["messages"]:
+        return "messages.list"
+    if resource == ["history"]:
+        return "history.list"
+    if len(resource) == 2 and resource[0] == "messages" and resource[1] != "batchModify":
+        return "messages.get"
+    return ".".join(resource) or "unknown"
+
+class Mailbox:
+    def __init__(self, index):
+        self.index = index
+        self.history_id = 1000
+        self.messages = {}
+        self.history = []
+
+    def deliver(self, message):
+        self.history_id += 1
+        self.messages[message["id"]] = message
+        self.history.append((self.history_id, message["id"]))
+        if len(self.history) > HISTORY_KEEP:
+            dropped = self.history[:-HISTORY_KEEP]
+            self.history = self.history[-HISTORY_KEEP:]
+            for _, mid in dropped:
+                self.messages.pop(mid, None)
+
+class FakeServices:
+    def __init__(self, accounts, otp_rate=0.2, noise_rate=0.5, body_only=0.1,
+                 gmail_latency=0.04, gmail_error_rate=0.0, telegram_latency=0.03, telegram_error_rate=0.0):
+        self.mailboxes = [Mailbox(i) for i in range(accounts)]
+        self.tokens = {account_token(i): i for i in range(accounts)}
+        self.otp_rate = otp_rate
+        self.noise_rate = noise_rate
+        self.body_only = body_only
+        self.gmail_latency = gmail_latency
+        self.gmail_error_rate = gmail_error_rate
+        self.telegram_latency = telegram_latency
+        self.telegram_error_rate = telegram_error_rate
+        self.lock = threading.Lock()
+        self.next_message_id = 1
+        self.injected = {}
+        self.latencies = []
+        self.counters = {
+            "gmail_http_requests": 0,
+            "gmail_calls": 0,
+            "gmail_errors": 0,
+            "telegram_calls": 0,
+            "telegram_errors": 0,
+            "otps_injected": 0,
+            "otps_delivered": 0,
+            "noise_injected": 0,
+        }
+        self.gmail_methods = {}
+        self.telegram_methods = {}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def sleep(self, latency):
+        if latency:
+            time.sleep(latency * random.uniform(0.5, 1.5))
+
+    # --- mail traffic ---
+
+    def inject(self, index, otp=True):
+        with self.lock:
+            mid = f"{self.next_message_id:016x}"
+            self.next_message_id += 1
+        now = time.time()
+        if otp:
+            code = f"{random.randint(0, 999999):06d}"
+            subject = "Your verification code"
+            if random.random() < self.body_only:
+                snippet = "Use the code in this email to finish signing in. It expires in 10 minutes."
+            else:
+                snippet = f"Your verification code is {code}. It expires in 10 minutes."
+            body = f"Hi,\n\nYour verification code is {code}.\n\nIf you didn't ask for it, ignore this email."
+            sender = "Acme Accounts <no-reply@acme.test>"
+        else:
+            code = None
+            subject = "This week's deals"
+            snippet = "Deal of the day - save 30% on 2000+ items, from $19.99"
+            body = snippet * 20
+            sender = "Deals <news@shop.test>"
+        message = {
+            "id": mid,
+            "internalDate": str(int(now * 1000)),
+            "labelIds": ["INBOX", "UNREAD"],
+            "snippet": snippet,
+            "subject": subject,
+            "sender": sender,
+            "body": body,
+        }
+        with self.lock:
+            self.mailboxes[index].deliver(message)
+            if code:
+                self.injected[(account_chat_id(index), code)] = now
+                self.counters["otps_injected"] += 1
+            else:
+                self.counters["noise_injected"] += 1
+        return code
+
+    def run_traffic(self, stop):
+        per_second = len(self.mailboxes) * (self.otp_rate + self.noise_rate) / 60
+        otp_share = self.otp_rate / (self.otp_rate + self.noise_rate) if per_second else 0
+        pending = 0.0
+        last = time.monotonic()
+        while not stop.is_set():
+            time.sleep(0.05)
+            now = time.monotonic()
+            pending += (now - last) * per_second
+            last = now
+            while pending >= 1:
+                pending -= 1
+                self.inject(random.randrange(len(self.mailboxes)), otp=random.random() < otp_share)
+
+    # --- Gmail ---
+
+    def gmail_error(self):
+        if self.gmail_error_rate and random.random() < self.gmail_error_rate:
+            self.count("gmail_errors")
+            if random.random() < 0.5:
+                return 429, {"error": {"code": 429, "message": "Rate Limit Exceeded", "status": "RESOURCE_EXHAUSTED"}}
+            return 500, {"error": {"code": 500, "message": "Backend Error", "status": "INTERNAL"}}
+        return None
+
+    def gmail_call(self, method, path, query, headers, body):
+        token = headers.get("Authorization", "").replace("Bearer ", "", 1)
+        index = self.tokens.get(token)
+        if index is None:
+            return 401, {"error": {"code": 401, "message": "Invalid Credentials", "status": "UNAUTHENTICATED"}}
+        parts = path.strip("/").split("/")
+        # gmail/v1/users/me/<resource>[/<id>]
+        resource = parts[4:] if len(parts) > 4 else []
+        name = gmail_method_name(resource)
+        with self.lock:
+            self.counters["gmail_calls"] += 1
+            self.gmail_methods[name] = self.gmail_methods.get(name, 0) + 1
+        error = self.gmail_error()
+        if error:
+            return error
+        mailbox = self.mailboxes[index]
+
+        if resource == ["profile"]:
+            return 200, {"emailAddress": account_email(index), "historyId": str(mailbox.history_id)}
+        if resource == ["watch"]:
+            return 200, {"historyId": str(mailbox.history_id), "expiration": str(int((time.time() + 7 * 86400) * 1000))}
+        if resource == ["history"]:
+            start = int(query.get("startHistoryId", ["0"])[0])
+            with self.lock:
+                if mailbox.history and start < mailbox.history[0][0] - 1:
+                    return 404, {"error": {"code": 404, "message": "Requested entity was not found.", "status": "NOT_FOUND"}}
+                records = []
+                for history_id, mid in mailbox.history:
+                    message = mailbox.messages.get(mid)
+                    if history_id > start and message is not None:
+                        records.append({
+                            "id": str(history_id),
+                            "messagesAdded": [{"message": {"id": mid, "threadId": mid, "labelIds": list(message["labelIds"])}}],
+                        })
+                current = mailbox.history_id
+            response = {"historyId": str(current)}
+            if records:
+                response["history"] = records
+            return 200, response
+        if resource == ["messages"] and method == "GET":
+            limit = int(query.get("maxResults", ["100"])[0])
+            with self.lock:
+                unread = [m for m in reversed(list(mailbox.messages.values())) if "UNREAD" in m["labelIds"]]
+            return 200, {"messages": [{"id": m["id"], "threadId": m["id"]} for m in unread[:limit]], "resultSizeEstimate": len(unread)}
+        if resource == ["messages", "batchModify"]:
+            request = json.loads(body or b"{}")
+            with self.lock:
+                for mid in request.get("ids", []):
+                    message = mailbox.messages.get(mid)
+                    if message is not None:
+                        for label in request.get("removeLabelIds", []):
+                            if label in message["labelIds"]:
+                                message["labelIds"].remove(label)
+            return 204, None
+        if len(resource) == 2 and resource[0] == "messages":
+            message = mailbox.messages.get(resource[1])
+            if message is None:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found.", "status": "NOT_FOUND"}}
+            headers = [{"name": "Subject", "value": message["subject"]}, {"name": "From", "value": message["sender"]}]
+            response = {
+                "id": message["id"],
+                "threadId": message["id"],
+                "labelIds": list(message["labelIds"]),
+                "internalDate": message["internalDate"],
+                "snippet": message["snippet"],
+                "payload": {"mimeType": "text/plain", "headers": headers},
+            }
+            if query.get("format", ["full"])[0] == "full":
+                response["payload"]["body"] = {"data": encode(message["body"])}
+            return 200, response
+        return 404, {"error": {"code": 404, "message": f"No fake for {method} {path}", "status": "NOT_FOUND"}}
+
+    def gmail_batch(self, content_type, body):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+        )
+        boundary = "batch_" + format(random.getrandbits(64), "x")
+        out = []
+        for part in message.iter_parts():
+            raw = part.get_payload(decode=True) or b""
+            head, _, sub_body = raw.replace(b"\r\n", b"\n").partition(b"\n\n")
+            lines = head.decode("utf-8").split("\n")
+            method, target, _ = lines[0].split(" ", 2)
+            headers = {}
+            for line in lines[1:]:
+                key, _, value = line.partition(":")
+                headers[key.strip().title()] = value.strip()
+            url = urlparse(target)
+            status, payload = self.gmail_call(method, url.path, parse_qs(url.query), headers, sub_body)
+            text = json.dumps(payload) if payload is not None else ""
+            content_id = part.get("Content-ID", "<unknown + 0>")
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id[1:]}\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\nContent-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(text)}\r\n\r\n{text}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        return f"multipart/mixed; boundary={boundary}", "".join(out).encode("utf-8")
+
+    # --- Telegram ---
+
+    def telegram_call(self, method, params):
+        with self.lock:
+            self.counters["telegram_calls"] += 1
+            self.telegram_methods[method] = self.telegram_methods.get(method, 0) + 1
+        if method != "getMe" and self.telegram_error_rate and random.random() < self.telegram_error_rate:
+            self.count("telegram_errors")
+            return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1", "parameters": {"retry_after": 1}}
+
+        if method == "getUpdates":
+            # Nobody talks to the fake bot; hold the long poll briefly and come back empty.
+            time.sleep(min(float(params.get("timeout", 0) or 0), 1.0))
+            return 200, {"ok": True, "result": []}
+        if method == "getMe":
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}}
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            text = params.get("text", "")
+            now = time.time()
+            with self.lock:
+                # Codes reach the user either as a push or in the "Check Latest OTP" reply.
+                for code in CODE_REGEX.findall(text):
+                    injected = self.injected.pop((chat_id, code), None)
+                    if injected is not None:
+                        self.latencies.append(now - injected)
+                        self.counters["otps_delivered"] += 1
+                if method == "sendMessage":
+                    self.next_message_id += 1
+                    message_id = self.next_message_id
+                else:
+                    message_id = int(params.get("message_id", 1))
+            return 200, {"ok": True, "result": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text,
+            }}
+        return 200, {"ok": True, "result": True}
+
+    # --- OAuth ---
+
+    def token_call(self, params):
+        refresh_token = params.get("refresh_token", "")
+        index = refresh_token.rsplit("-", 1)[-1]
+        return 200, {"access_token": account_token(int(index)) if index.isdigit() else "invalid", "expires_in": 3600, "token_type": "Bearer"}
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counters,
+                "otps_pending": len(self.injected),
+                "otp_latency": percentiles(self.latencies),
+                "gmail_methods": dict(self.gmail_methods),
+                "telegram_methods": dict(self.telegram_methods),
+            }
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status, payload, content_type="application/json"):
+            if isinstance(payload, bytes):
+                body = payload
+            else:
+                body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+            try:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The bot under test was stopped mid long-poll.
+                pass
+
+        def read_body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return self.rfile.read(length) if length else b""
+
+        def form(self, body):
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                return json.loads(body or b"{}")
+            return {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+
+        def handle_any(self, method):
+            url = urlparse(self.path)
+            body = self.read_body()
+            if url.path == "/_stats":
+                return self.reply(200, fake.stats())
+            if url.path == "/token":
+                return self.reply(*fake.token_call(self.form(body)))
+            if url.path.startswith("/bot"):
+                fake.sleep(fake.telegram_latency)
+                method_name = url.path.rsplit("/", 1)[-1]
+                return self.reply(*fake.telegram_call(method_name, self.form(body)))
+
+            fake.count("gmail_http_requests")
+            fake.sleep(fake.gmail_latency)
+            if url.path == "/batch":
+                content_type, payload = fake.gmail_batch(self.headers.get("Content-Type", ""), body)
+                return self.reply(200, payload, content_type)
+            headers = {key.title(): value for key, value in self.headers.items()}
+            self.reply(*fake.gmail_call(method, url.path, parse_qs(url.query), headers, body))
+
+        def do_GET(self):
+            self.handle_any("GET")
+
+        def do_POST(self):
+            self.handle_any("POST")
+
+    return Handler
+
+def serve(fake, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-http").start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Gmail + Telegram Bot API servers for load tests")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--otp-rate", type=float, default=0.2, help="OTP mails per account per minute")
+    parser.add_argument("--noise-rate", type=float, default=0.5, help="other mails per account per minute")
+    parser.add_argument("--body-only", type=float, default=0.1, help="share of OTP mails with the code only in the body")
+    parser.add_argument("--gmail-latency-ms", type=float, default=40)
+    parser.add_argument("--gmail-error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency-ms", type=float, default=30)
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeServices(
+        args.accounts, args.otp_rate, args.noise_rate, args.body_only,
+        args.gmail_latency_ms / 1000, args.gmail_error_rate,
+        args.telegram_latency_ms / 1000, args.telegram_error_rate
+    )
+    server = serve(fake, args.port)
+    stop = threading.Event()
+    threading.Thread(target=fake.run_traffic, args=(stop,), daemon=True, name="fake-traffic").start()
+    print(f"Fake Gmail/Telegram serving {args.accounts} accounts on http://127.0.0.1:{server.server_address[1]}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stop.set()
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
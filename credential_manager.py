@@ -0,0 +1,159 @@
+import random
+import threading
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+# google.auth pulls in requests; it's imported on first use so startup doesn't pay for it.
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+def creds_to_dict(creds: "Credentials"):
+    return {
+        "token": creds.token,
+        "refresh_token": creds.refresh_token,
+        "token_uri": creds.token_uri,
+        "client_id": creds.client_id,
+        "client_secret": creds.client_secret,
+        "scopes": creds.scopes,
+        "expiry": creds.expiry.isoformat() if creds.expiry else None
+    }
+
+def creds_from_dict(d: dict) -> "Credentials":
+    from google.oauth2.credentials import Credentials
+
+    creds = Credentials(
+        token=d["token"],
+        refresh_token=d["refresh_token"],
+        token_uri=d["token_uri"],
+        client_id=d["client_id"],
+        client_secret=d["client_secret"],
+        scopes=d["scopes"]
+    )
+    if d.get("expiry"):
+        creds.expiry = datetime.fromisoformat(d["expiry"])
+    return creds
+
+class CredentialManager:
+    # Each refresh is scheduled refresh_margin seconds before expiry minus a random
+    # jitter, so tokens issued together don't all come due in the same instant.
+    def __init__(self, refresh_margin=300, jitter=240, check_interval=5, retry_delay=60, on_refresh=None,
+                 on_failure=None, is_paused=None):
+        self.refresh_margin = refresh_margin
+        self.jitter = jitter
+        self.check_interval = check_interval
+        self.retry_delay = retry_delay
+        self.on_refresh = on_refresh
+        self.on_failure = on_failure
+        # Accounts it returns True for (e.g. circuit open) are skipped until it doesn't.
+        self.is_paused = is_paused
+        self._creds = {}
+        self._due = {}
+        self._refresh_locks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.refresh_count = 0
+        self.refresh_failures = 0
+
+    def add(self, email, creds):
+        if isinstance(creds, dict):
+            creds = creds_from_dict(creds)
+        with self._lock:
+            self._creds[email] = creds
+            self._refresh_locks.setdefault(email, threading.Lock())
+            self._due[email] = self._next_refresh_at(creds)
+        return creds
+
+    def remove(self, email):
+        with self._lock:
+            self._creds.pop(email, None)
+            self._due.pop(email, None)
+            self._refresh_locks.pop(email, None)
+
+    def get(self, email):
+        with self._lock:
+            creds = self._creds.get(email)
+        if creds is not None and not creds.valid and creds.refresh_token:
+            # The background refresher fell behind; don't hand out a dead token.
+            self.refresh(email)
+        return creds
+
+    def to_dict(self, email):
+        with self._lock:
+            creds = self._creds.get(email)
+        return creds_to_dict(creds) if creds is not None else None
+
+    def __contains__(self, email):
+        return email in self._creds
+
+    def __len__(self):
+        return len(self._creds)
+
+    def refresh(self, email, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            creds = self._creds.get(email)
+            refresh_lock = self._refresh_locks.get(email)
+        if creds is None or refresh_lock is None:
+            return False
+
+        from google.auth.transport.requests import Request
+
+        with refresh_lock:
+            # Another thread may have refreshed (and rescheduled) while we waited.
+            if creds.valid and self._due.get(email, 0) > now:
+                return True
+            try:
+                creds.refresh(Request())
+            except Exception as e:
+                self.refresh_failures += 1
+                print(f"Token refresh failed for {email}: {e}")
+                if self.on_failure:
+                    self.on_failure(email, e)
+                with self._lock:
+                    if email in self._due:
+                        self._due[email] = time.time() + self.retry_delay
+                return False
+
+        self.refresh_count += 1
+        with self._lock:
+            if email in self._due:
+                self._due[email] = self._next_refresh_at(creds)
+        if self.on_refresh:
+            self.on_refresh(email, creds)
+        return True
+
+    def refresh_due(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            due = [email for email, at in self._due.items() if at <= now]
+        if self.is_paused:
+            due = [email for email in due if not self.is_paused(email)]
+        for email in due:
+            self.refresh(email, now)
+        return len(due)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="token-refresh")
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh_due()
+            except Exception as e:
+                print(f"Token refresher error: {e}")
+            time.sleep(self.check_interval)
+
+    def _seconds_left(self, creds):
+        if creds.expiry is None:
+            return 0
+        return (creds.expiry - datetime.utcnow()).total_seconds()
+
+    def _next_refresh_at(self, creds):
+        if creds.expiry is None or not creds.token:
+            # Unknown expiry (e.g. restored without one): refresh soon to learn it.
+            return time.time() + random.uniform(0, self.jitter)
+        left = self._seconds_left(creds)
+        return time.time() + max(0, left - self.refresh_margin - random.uniform(0, self.jitter))
@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import os
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+class DeleteScheduler:
+    # One min-heap of (due, chat_id, message_id) replaces a sleeping task per
+    # message. Every schedule and every finished deletion is appended to a
+    # journal, so pending deletions survive restarts; the journal is rewritten
+    # with just the pending entries once finished lines pile up.
+    def __init__(self, bot, journal_path, batch_size=20, batch_interval=1.0):
+        self.bot = bot
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self._heap = []
+        self._pending = {}
+        self._journal = None
+        self._finished_lines = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.deleted = 0
+        self.failed = 0
+
+    def load(self):
+        pending = {}
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                for line in f:
+                    parts = line.split()
+                    try:
+                        if parts[0] == "+":
+                            pending[(int(parts[2]), int(parts[3]))] = float(parts[1])
+                        elif parts[0] == "-":
+                            pending.pop((int(parts[1]), int(parts[2])), None)
+                    except (IndexError, ValueError):
+                        # A torn last line from a crash mid-write; skip it.
+                        continue
+        self._pending = pending
+        self._heap = [(due, chat_id, message_id) for (chat_id, message_id), due in pending.items()]
+        heapq.heapify(self._heap)
+        self._compact()
+        return len(pending)
+
+    def start(self):
+        if self._journal is None:
+            self.load()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def schedule(self, chat_id, message_id, delay_seconds):
+        key = (int(chat_id), int(message_id))
+        due = time.time() + delay_seconds
+        if key in self._pending and self._pending[key] <= due:
+            return
+        self._pending[key] = due
+        heapq.heappush(self._heap, (due, key[0], key[1]))
+        self._write(f"+ {due:.3f} {key[0]} {key[1]}")
+        if self._heap[0][0] == due:
+            self._wakeup.set()
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def _write(self, line):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a")
+        self._journal.write(line + "\n")
+        self._journal.flush()
+
+    def _compact(self):
+        if self._journal is not None:
+            self._journal.close()
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for (chat_id, message_id), due in self._pending.items():
+                f.write(f"+ {due:.3f} {chat_id} {message_id}\n")
+        os.replace(tmp_path, self.journal_path)
+        self._journal = open(self.journal_path, "a")
+        self._finished_lines = 0
+
+    def _finish(self, chat_id, message_id):
+        self._pending.pop((chat_id, message_id), None)
+        self._write(f"- {chat_id} {message_id}")
+        self._finished_lines += 1
+        if self._finished_lines > 1000 and self._finished_lines > 2 * len(self._pending):
+            self._compact()
+
+    def _pop_due(self, now):
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+            due, chat_id, message_id = heapq.heappop(self._heap)
+            # Skip heap entries superseded by an earlier reschedule.
+            if self._pending.get((chat_id, message_id)) == due:
+                batch.append((chat_id, message_id))
+        return batch
+
+    async def _delete(self, chat_id, message_id):
+        try:
+            await self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            self.deleted += 1
+        except RetryAfter as e:
+            value = e.retry_after
+            self._pending.pop((chat_id, message_id), None)
+            self.schedule(chat_id, message_id, value.total_seconds() if hasattr(value, "total_seconds") else value)
+            return
+        except BadRequest as e:
+            # Already deleted by the user, or older than Telegram lets bots delete.
+            self.failed += 1
+            print(f"Auto-delete skipped for {chat_id}/{message_id}: {e}")
+        except Exception as e:
+            self.failed += 1
+            print(f"Auto-delete failed: {e}")
+        self._finish(chat_id, message_id)
+
+    async def _run(self):
+        while True:
+            try:
+                now = time.time()
+                batch = self._pop_due(now)
+                if batch:
+                    await asyncio.gather(*(self._delete(chat_id, message_id) for chat_id, message_id in batch))
+                    await asyncio.sleep(self.batch_interval)
+                    continue
+
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except Exception as e:
+                print(f"Delete scheduler error: {e}")
+                await asyncio.sleep(self.batch_interval)
@@ -0,0 +1,199 @@
+import random
+import threading
+import time
+
+from google.auth.exceptions import RefreshError
+from googleapiclient.errors import HttpError
+
+# Quota units per call, from the Gmail API usage limits.
+METHOD_UNITS = {
+    "gmail.users.getProfile": 1,
+    "gmail.users.watch": 100,
+    "gmail.users.stop": 50,
+    "gmail.users.history.list": 2,
+    "gmail.users.messages.list": 5,
+    "gmail.users.messages.get": 5,
+    "gmail.users.messages.modify": 5,
+    "gmail.users.messages.batchModify": 50,
+}
+DEFAULT_UNITS = 5
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+class GmailUnavailable(Exception):
+    def __init__(self, email, retry_after, reason):
+        super().__init__(f"Gmail calls for {email} paused for {retry_after:.0f}s ({reason})")
+        self.email = email
+        self.retry_after = retry_after
+        self.reason = reason
+
+def error_reason(error):
+    details = getattr(error, "error_details", None)
+    if isinstance(details, list):
+        for detail in details:
+            if isinstance(detail, dict) and detail.get("reason"):
+                return detail["reason"]
+    return ""
+
+def classify_error(error):
+    if isinstance(error, RefreshError):
+        return "auth"
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status == 429 or (status == 403 and error_reason(error) in RATE_LIMIT_REASONS):
+            return "rate_limited"
+        if status in (401, 403):
+            return "auth"
+        if status >= 500:
+            return "transient"
+        # 400/404 and friends are about the request (e.g. an expired history cursor), not the account.
+        return "client"
+    return "transient"
+
+def retry_after_header(error):
+    if isinstance(error, HttpError):
+        try:
+            return float(error.resp.get("retry-after", 0))
+        except (TypeError, ValueError):
+            pass
+    return 0.0
+
+class UnitBucket:
+    # Reservation-style token bucket: callers take their units up front, going
+    # negative if needed, and sleep off the deficit, so waiters queue fairly.
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, units, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= units
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, units):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + units)
+
+class GmailQuota:
+    # Paces Gmail calls under the per-user and per-project unit limits, and
+    # keeps per-account failure state: rate limits and server errors back the
+    # account off exponentially (with jitter); repeated failures, or auth errors
+    # such as a revoked token, open a circuit so its polls stop taking worker
+    # time. Once the circuit's timer runs out the next poll is the probe: success
+    # closes it, another failure reopens it for twice as long.
+    def __init__(self, user_rate=250, project_rate=20000, max_wait=5.0, backoff_base=2.0, backoff_max=300,
+                 failure_threshold=5, auth_threshold=2, open_seconds=300, max_open_seconds=6 * 3600):
+        self.user_rate = user_rate
+        self.project = UnitBucket(project_rate)
+        self.max_wait = max_wait
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.auth_threshold = auth_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self._users = {}
+        self._state = {}
+        self._lock = threading.Lock()
+        self.units_used = 0
+        self.wait_seconds = 0.0
+        self.circuits_opened = 0
+
+    def set_project_rate(self, rate):
+        self.project = UnitBucket(rate)
+
+    def _user_bucket(self, email):
+        with self._lock:
+            bucket = self._users.get(email)
+            if bucket is None:
+                bucket = self._users[email] = UnitBucket(self.user_rate)
+            return bucket
+
+    def _account(self, email):
+        state = self._state.get(email)
+        if state is None:
+            state = self._state[email] = {"failures": 0, "backoffs": 0, "retry_at": 0.0, "opens": 0, "open_until": 0.0}
+        return state
+
+    def remove(self, email):
+        with self._lock:
+            self._users.pop(email, None)
+            self._state.pop(email, None)
+
+    def wait_time(self, email, now=None):
+        now = time.monotonic() if now is None else now
+        state = self._state.get(email)
+        if state is None:
+            return 0.0
+        return max(0.0, state["retry_at"] - now, state["open_until"] - now)
+
+    def acquire(self, email, method, count=1):
+        wait = self.wait_time(email)
+        if wait > 0:
+            state = self._state.get(email) or {}
+            raise GmailUnavailable(email, wait, "circuit open" if state.get("open_until", 0) > time.monotonic() else "backing off")
+
+        units = METHOD_UNITS.get(method, DEFAULT_UNITS) * count
+        user = self._user_bucket(email)
+        now = time.monotonic()
+        wait = max(user.reserve(units, now), self.project.reserve(units, now))
+        if wait > self.max_wait:
+            user.refund(units)
+            self.project.refund(units)
+            raise GmailUnavailable(email, wait, "quota")
+        with self._lock:
+            self.units_used += units
+            self.wait_seconds += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def record_success(self, email):
+        state = self._state.get(email)
+        if state is not None and (state["failures"] or state["backoffs"] or state["opens"]):
+            with self._lock:
+                state.update(failures=0, backoffs=0, opens=0)
+
+    def record_failure(self, email, error):
+        kind = classify_error(error)
+        if kind == "client":
+            return kind
+        now = time.monotonic()
+        with self._lock:
+            state = self._account(email)
+            if state["open_until"] > now:
+                # A call already in flight when the circuit opened; it's open either way.
+                return kind
+            if kind != "rate_limited":
+                state["failures"] += 1
+            threshold = self.auth_threshold if kind == "auth" else self.failure_threshold
+            # opens only goes back to 0 on a success, so while it's set this failure is the probe.
+            probe_failed = state["opens"] and kind != "rate_limited"
+            if probe_failed or state["failures"] >= threshold:
+                state["opens"] += 1
+                state["failures"] = 0
+                duration = min(self.max_open_seconds, self.open_seconds * 2 ** (state["opens"] - 1))
+                state["open_until"] = now + duration
+                self.circuits_opened += 1
+                print(f"🔌 Gmail circuit open for {email} for {duration:.0f}s after repeated {kind} errors: {error}")
+            else:
+                state["backoffs"] += 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (state["backoffs"] - 1))
+                delay = max(random.uniform(delay / 2, delay), retry_after_header(error))
+                state["retry_at"] = max(state["retry_at"], now + delay)
+        return kind
+
+    def paused_counts(self, now=None):
+        now = time.monotonic() if now is None else now
+        counts = {"backoff": 0, "circuit_open": 0}
+        with self._lock:
+            for state in self._state.values():
+                if state["open_until"] > now:
+                    counts["circuit_open"] += 1
+                elif state["retry_at"] > now:
+                    counts["backoff"] += 1
+        return counts
@@ -1,17 +1,39 @@
+from __future__ import annotations
+
 import os
+import sys
+import json
+import hmac
+import hashlib
+import base64
+import atexit
 import threading
 import time
-import re
-from flask import Flask, redirect, request, session
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+import signal
+import socket
+import multiprocessing
+from flask import Flask, Response, jsonify, redirect, request, session
+from googleapiclient.errors import HttpError
 import random
 import asyncio
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+from account_store import AccountStore
+from credential_manager import CredentialManager, creds_to_dict
+from poll_scheduler import PollScheduler
+from shard_leases import ShardLeases
+from metrics import MetricsRegistry
+from tracing import Tracer
+from gmail_quota import GmailQuota, GmailUnavailable, classify_error
+from otp_extractor import extract_otp, looks_like_otp_mail
+from state_snapshot import StateSnapshot
+
+# The Google API client, OAuth flow and python-telegram-bot take most of a cold
+# start to import; they're imported where first used instead.
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
 
 # Render.com specific configuration
 if 'RENDER' in os.environ:
@@ -20,13 +42,70 @@ else:
     BASE_URL = f"https://{os.getenv('REPLIT_DEV_DOMAIN', 'localhost:5000')}"
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Points the bot at a local Bot API server (or the benchmark fakes) instead of api.telegram.org.
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# "threaded": Flask dev server + getUpdates long polling on a loop thread.
+# "asgi": one uvicorn event loop serving Flask and a Telegram webhook route.
+SERVER_MODE = os.getenv("SERVER_MODE", "threaded")
+TELEGRAM_WEBHOOK_PATH = "/telegram/webhook"
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+PORT = int(os.getenv("PORT", "5000"))
+# Start answering HTTP straight away and restore accounts / connect the bot
+# behind it; FAST_START=0 finishes all of that before serving.
+FAST_START = os.getenv("FAST_START", "1") != "0"
 OAUTH_CLIENT_SECRETS_FILE = os.getenv("OAUTH_CLIENT_SECRETS_FILE", "client_secret.json")
 FLASK_SECRET_KEY = os.getenv("SESSION_SECRET", "render-secret-key-change-in-production")
 POLL_INTERVAL_SECONDS = 15
+POLL_WORKERS = int(os.getenv("POLL_WORKERS", "32"))
+# Threads for on-demand "Check Latest OTP" lookups, kept apart from the poller's.
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))
+POLL_ACCOUNT_TIMEOUT_SECONDS = int(os.getenv("POLL_ACCOUNT_TIMEOUT_SECONDS", "10"))
+GMAIL_BATCH_SIZE = 50
+GMAIL_DISCOVERY_FILE = os.getenv("GMAIL_DISCOVERY_FILE")
+ACCOUNTS_DB = os.getenv("ACCOUNTS_DB", "accounts.db")
+GMAIL_PUSH_TOPIC = os.getenv("GMAIL_PUSH_TOPIC")
+PUSH_VERIFICATION_TOKEN = os.getenv("PUSH_VERIFICATION_TOKEN")
+PUSH_SAFETY_POLL_SECONDS = int(os.getenv("PUSH_SAFETY_POLL_SECONDS", "300"))
+WATCH_RENEW_BEFORE_SECONDS = 24 * 3600
+WATCH_RETRY_SECONDS = 600
+HOT_POLL_INTERVAL_SECONDS = 3
+HOT_POLL_DURATION_SECONDS = 300
+IDLE_POLL_MAX_SECONDS = int(os.getenv("IDLE_POLL_MAX_SECONDS", "120"))
+POLL_STATS_INTERVAL_SECONDS = 60
+DELETE_JOURNAL = os.getenv("DELETE_JOURNAL", "pending_deletes.log")
+# Poll tiers, due times and watch expirations aren't in the database; they're
+# saved here periodically and at shutdown so a restart carries on from them.
+STATE_SNAPSHOT = os.getenv("STATE_SNAPSHOT", "state_snapshot.json")
+STATE_SNAPSHOT_SECONDS = 60
+OTP_DELETE_SECONDS = 120
+QUERY_WINDOW_SECONDS = 3600
+# Remember message IDs a bit longer than any query can look back.
+SEEN_WINDOW_SECONDS = QUERY_WINDOW_SECONDS * 2
+# "Check Latest OTP" answers from the last few OTPs the poller found while the
+# account was polled this recently, instead of searching Gmail again.
+RECENT_OTP_LIMIT = 5
+RECENT_OTP_FRESH_SECONDS = int(os.getenv("RECENT_OTP_FRESH_SECONDS", "30"))
+# "all" runs everything in one process; "web" serves Flask and the bot and hands
+# polling to "worker" processes, which split the accounts between them by shard.
+SERVICE_ROLE = os.getenv("SERVICE_ROLE", "all")
+POLL_PROCESSES = int(os.getenv("POLL_PROCESSES", "0"))
+SHARD_COUNT = 64
+SHARD_LEASE_SECONDS = 15
+SHARD_HEARTBEAT_SECONDS = 5
+TELEGRAM_GLOBAL_RATE = 25
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Poll workers serve their own /metrics on WORKER_METRICS_PORT + worker index.
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+GMAIL_USER_UNITS_PER_SECOND = 250
+GMAIL_PROJECT_UNITS_PER_SECOND = int(os.getenv("GMAIL_PROJECT_UNITS_PER_SECOND", "20000"))
+# Keep (and print) a span breakdown of any poll slower than this; unset turns tracing off.
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS")) if os.getenv("TRACE_SLOW_SECONDS") else None
 
 EMAIL_BASE = "TeleGramerKajkOrboeiTADIyeoKK"
 DEFAULT_DOMAIN = "gmail.com"
-OTP_REGEX = re.compile(r"\b(\d{4,8})\b")
+OTP_METADATA_HEADERS = ["Subject", "From"]
+OTP_METADATA_FIELDS = "id,internalDate,snippet,payload/headers"
+OTP_BODY_FIELDS = "id,payload(mimeType,body/data,parts)"
 
 SCOPES = [
     "https://www.googleapis.com/auth/userinfo.email",
@@ -37,7 +116,65 @@ SCOPES = [
 app = Flask(__name__)
 app.secret_key = FLASK_SECRET_KEY
 
-USERS = {}
+ACCOUNTS = AccountStore(ACCOUNTS_DB, seen_window_seconds=SEEN_WINDOW_SECONDS)
+CREDENTIALS = CredentialManager(
+    on_refresh=lambda email, creds: ACCOUNTS.update_creds(email, creds_to_dict(creds)),
+    # A revoked token counts toward the account's circuit, and isn't retried while it's open.
+    on_failure=lambda email, error: QUOTA.record_failure(email, error),
+    is_paused=lambda email: QUOTA.wait_time(email) > 0
+)
+GMAIL_SERVICES = {}
+GMAIL_SERVICES_LOCK = threading.Lock()
+GMAIL_DISCOVERY_DOC = None
+POLL_EXECUTOR = ThreadPoolExecutor(max_workers=POLL_WORKERS, thread_name_prefix="poll")
+FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch")
+FETCH_IN_FLIGHT = {}
+POLL_IN_FLIGHT = {}
+POLL_RERUN = set()
+POLL_LOCK = threading.Lock()
+ROLE = "all"
+LEASES = None
+POLL_STATS = {"polls": 0, "last_poll_seconds": 0.0, "max_lag_seconds": 0.0}
+SCHEDULER = PollScheduler(
+    base_interval=PUSH_SAFETY_POLL_SECONDS if GMAIL_PUSH_TOPIC else POLL_INTERVAL_SECONDS,
+    hot_interval=HOT_POLL_INTERVAL_SECONDS,
+    hot_duration=HOT_POLL_DURATION_SECONDS,
+    max_interval=PUSH_SAFETY_POLL_SECONDS * 3 if GMAIL_PUSH_TOPIC else IDLE_POLL_MAX_SECONDS
+)
+TRACER = Tracer(slow_seconds=TRACE_SLOW_SECONDS)
+SNAPSHOT = StateSnapshot(STATE_SNAPSHOT, collect=lambda: snapshot_accounts(), interval=STATE_SNAPSHOT_SECONDS)
+SAVED_STATE = {}
+QUOTA = GmailQuota(user_rate=GMAIL_USER_UNITS_PER_SECOND, project_rate=GMAIL_PROJECT_UNITS_PER_SECOND)
+
+METRICS = MetricsRegistry(prefix="otpbot_")
+OTP_DELIVERY_SECONDS = METRICS.histogram(
+    "otp_delivery_seconds", "Time from Gmail internalDate to the Telegram message being sent",
+    buckets=(1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 300, 600)
+)
+POLL_SECONDS = METRICS.histogram("poll_duration_seconds", "Duration of one account poll")
+POLL_LAG_SECONDS = METRICS.histogram("poll_lag_seconds", "How late a scheduled poll was picked up")
+POLLS = METRICS.counter("polls_total", "Account polls by outcome", ["outcome"])
+GMAIL_CALLS = METRICS.counter("gmail_api_calls_total", "Gmail API calls by method", ["method"])
+GMAIL_ERRORS = METRICS.counter("gmail_api_errors_total", "Failed Gmail API calls by method and status", ["method", "status"])
+GMAIL_SECONDS = METRICS.histogram("gmail_api_seconds", "Gmail API call latency by method", ["method"])
+TELEGRAM_SEND_SECONDS = METRICS.histogram("telegram_send_seconds", "Time from queueing a bot message to Telegram accepting it")
+RECENT_OTP_LOOKUPS = METRICS.counter("latest_otp_lookups_total", "Check Latest OTP answers by source", ["source"])
+METRICS.counter("token_refreshes_total", "OAuth token refreshes", callback=lambda: CREDENTIALS.refresh_count)
+METRICS.counter("token_refresh_failures_total", "Failed OAuth token refreshes", callback=lambda: CREDENTIALS.refresh_failures)
+METRICS.counter("telegram_messages_sent_total", "Bot messages sent", callback=lambda: DISPATCHER.sent if DISPATCHER else 0)
+METRICS.counter("telegram_send_failures_total", "Bot messages dropped after retries", callback=lambda: DISPATCHER.failed if DISPATCHER else 0)
+METRICS.counter("telegram_rate_limited_total", "Telegram 429 responses", callback=lambda: DISPATCHER.rate_limited if DISPATCHER else 0)
+METRICS.counter("telegram_coalesced_total", "Notifications merged into an already queued message", callback=lambda: DISPATCHER.coalesced if DISPATCHER else 0)
+METRICS.gauge("telegram_queue_depth", "Bot messages waiting to be sent", callback=lambda: DISPATCHER.queue_depth() if DISPATCHER else 0)
+METRICS.gauge("pending_deletes", "Bot messages waiting to be auto-deleted", callback=lambda: DELETER.pending_count() if DELETER else 0)
+METRICS.gauge("accounts", "Connected Gmail accounts known to this process", callback=lambda: len(ACCOUNTS))
+METRICS.gauge("scheduled_accounts", "Accounts this process polls, by polling tier", ["tier"], callback=lambda: SCHEDULER.tiers())
+METRICS.gauge("polls_in_flight", "Account polls currently running", callback=lambda: len(POLL_IN_FLIGHT))
+METRICS.counter("gmail_quota_units_total", "Gmail quota units spent", callback=lambda: QUOTA.units_used)
+METRICS.counter("gmail_quota_wait_seconds_total", "Time spent pacing Gmail calls under quota", callback=lambda: QUOTA.wait_seconds)
+METRICS.counter("gmail_circuits_opened_total", "Times an account's Gmail circuit was opened", callback=lambda: QUOTA.circuits_opened)
+METRICS.gauge("gmail_paused_accounts", "Accounts whose Gmail calls are paused", ["state"], callback=lambda: QUOTA.paused_counts())
+METRICS.gauge("shards_owned", "Shards leased by this worker", callback=lambda: len(LEASES.owned) if LEASES else 0)
 
 def random_mixed_case(s):
     return ''.join(c.upper() if random.choice([True, False]) else c.lower() for c in s)
@@ -55,126 +192,338 @@ def generate_mixed_case_variation(email):
         return f"{local_mixed}@{domain_mixed}"
     return email
 
-def creds_to_dict(creds: Credentials):
-    return {
-        "token": creds.token,
-        "refresh_token": creds.refresh_token,
-        "token_uri": creds.token_uri,
-        "client_id": creds.client_id,
-        "client_secret": creds.client_secret,
-        "scopes": creds.scopes
-    }
-
-def creds_from_dict(d: dict) -> Credentials:
-    return Credentials(
-        token=d["token"],
-        refresh_token=d["refresh_token"],
-        token_uri=d["token_uri"],
-        client_id=d["client_id"],
-        client_secret=d["client_secret"],
-        scopes=d["scopes"]
-    )
+def get_user_by_chat_id(chat_id):
+    return ACCOUNTS.get_by_chat_id(chat_id)
 
-def extract_otps(text):
-    return OTP_REGEX.findall(text or "")
+def record_gmail_call(method, started, error=None):
+    GMAIL_CALLS.inc(method=method)
+    GMAIL_SECONDS.observe(time.monotonic() - started, method=method)
+    if error is not None:
+        status = error.resp.status if isinstance(error, HttpError) else type(error).__name__
+        GMAIL_ERRORS.inc(method=method, status=status)
 
-def get_user_by_chat_id(chat_id):
-    for email, data in USERS.items():
-        if str(data["chat_id"]) == str(chat_id):
-            return email, data
-    return None, None
+INSTRUMENTED_REQUEST = None
+
+def instrumented_request_class():
+    # Defined on first use, since it subclasses googleapiclient's HttpRequest.
+    global INSTRUMENTED_REQUEST
+    if INSTRUMENTED_REQUEST is not None:
+        return INSTRUMENTED_REQUEST
+    
+    from googleapiclient.http import HttpRequest
+    
+    class InstrumentedHttpRequest(HttpRequest):
+        def __init__(self, *args, email=None, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.email = email
+            self.track_failures = True
+        
+        def execute(self, http=None, num_retries=0):
+            method = self.methodId or "unknown"
+            if self.email:
+                QUOTA.acquire(self.email, method)
+            started = time.monotonic()
+            with TRACER.span(method):
+                try:
+                    result = super().execute(http=http, num_retries=num_retries)
+                except Exception as e:
+                    record_gmail_call(method, started, e)
+                    if self.email and self.track_failures:
+                        QUOTA.record_failure(self.email, e)
+                    raise
+            record_gmail_call(method, started)
+            if self.email:
+                QUOTA.record_success(self.email)
+            return result
+    
+    INSTRUMENTED_REQUEST = InstrumentedHttpRequest
+    return InstrumentedHttpRequest
+
+def gmail_http(creds):
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    
+    return AuthorizedHttp(creds, http=httplib2.Http(timeout=POLL_ACCOUNT_TIMEOUT_SECONDS))
+
+def load_gmail_discovery():
+    if GMAIL_DISCOVERY_FILE and os.path.exists(GMAIL_DISCOVERY_FILE):
+        with open(GMAIL_DISCOVERY_FILE) as f:
+            return json.load(f)
+    from googleapiclient.discovery_cache import get_static_doc
+    
+    return json.loads(get_static_doc("gmail", "v1"))
+
+def build_gmail_service(creds, email=None):
+    global GMAIL_DISCOVERY_DOC
+    from googleapiclient.discovery import build_from_document
+    
+    if GMAIL_DISCOVERY_DOC is None:
+        GMAIL_DISCOVERY_DOC = load_gmail_discovery()
+    request_class = instrumented_request_class()
+    
+    def request_builder(*args, **kwargs):
+        # Tag every request with its account so quota and failures are tracked per user.
+        return request_class(*args, email=email, **kwargs)
+    
+    return build_from_document(GMAIL_DISCOVERY_DOC, http=gmail_http(creds), requestBuilder=request_builder)
+
+@contextmanager
+def gmail_service(email):
+    creds = CREDENTIALS.get(email)
+    if creds is None:
+        raise KeyError(f"No credentials for {email}")
+    
+    with GMAIL_SERVICES_LOCK:
+        entry = GMAIL_SERVICES.get(email)
+        if entry is None or entry["creds"] is not creds:
+            entry = {"creds": creds, "service": build_gmail_service(creds, email), "lock": threading.Lock()}
+            GMAIL_SERVICES[email] = entry
+    
+    # httplib2 isn't thread-safe, so a client busy on another thread can't be shared.
+    if not entry["lock"].acquire(blocking=False):
+        yield build_gmail_service(creds, email)
+        return
+    
+    try:
+        yield entry["service"]
+    finally:
+        entry["lock"].release()
 
-async def schedule_auto_delete(chat_id, message_id, delay_seconds=60):
-    await asyncio.sleep(delay_seconds)
+def drop_gmail_service(email):
+    with GMAIL_SERVICES_LOCK:
+        GMAIL_SERVICES.pop(email, None)
+
+def batch_get_messages(service, ids, **kwargs):
+    results = {}
+    errors = []
+    
+    def collect(request_id, response, exception):
+        record_gmail_call("gmail.users.messages.get", started, exception)
+        if exception is None:
+            results[request_id] = response
+        elif classify_error(exception) == "client":
+            # E.g. a 404 for mail deleted since history.list; history keeps listing it,
+            # so failing the poll over it would stall the account's cursor for good.
+            print(f"Skipping message {request_id}: {exception}")
+        else:
+            errors.append(exception)
+            print(f"Batch get failed for {request_id}: {exception}")
+    
+    for i in range(0, len(ids), GMAIL_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=collect)
+        requests = [service.users().messages().get(userId="me", id=mid, **kwargs) for mid in ids[i:i + GMAIL_BATCH_SIZE]]
+        for mid, item in zip(ids[i:i + GMAIL_BATCH_SIZE], requests):
+            batch.add(item, request_id=mid)
+        email = requests[0].email
+        if email:
+            QUOTA.acquire(email, "gmail.users.messages.get", count=len(requests))
+        started = time.monotonic()
+        with TRACER.span("batch", size=len(requests)):
+            try:
+                batch.execute()
+            except Exception as e:
+                # The batch itself failed (token refresh, connection), not just some parts.
+                if email:
+                    QUOTA.record_failure(email, e)
+                raise
+        if errors:
+            # One failed batch counts once, however many of its parts failed. Raise so
+            # the poll keeps its history cursor and lists the failed messages again.
+            if email:
+                QUOTA.record_failure(email, errors[0])
+            raise errors[0]
+        if email:
+            QUOTA.record_success(email)
+    return [results[mid] for mid in ids if mid in results]
+
+def mark_messages_read(service, ids):
+    if not ids:
+        return
     try:
-        await telegram_app.bot.delete_message(chat_id=chat_id, message_id=message_id)
+        service.users().messages().batchModify(
+            userId="me",
+            body={"ids": ids, "removeLabelIds": ["UNREAD"]}
+        ).execute()
     except Exception as e:
-        print(f"Auto-delete failed: {e}")
+        print(f"Mark-as-read failed: {e}")
+
+def message_headers(msg):
+    subject = ""
+    sender = ""
+    for header in msg.get("payload", {}).get("headers", []):
+        if header.get("name", "").lower() == "subject":
+            subject = header.get("value", "")
+        if header.get("name", "").lower() == "from":
+            sender = header.get("value", "")
+    return subject, sender
+
+def fetch_otp_messages(service, ids):
+    # Headers and snippet are all the extractor usually needs; only pull bodies
+    # for messages that look like OTP mail but whose code didn't make the snippet.
+    msgs = batch_get_messages(
+        service, ids,
+        format='metadata',
+        metadataHeaders=OTP_METADATA_HEADERS,
+        fields=OTP_METADATA_FIELDS
+    )
+    
+    found = []
+    escalate = []
+    for msg in msgs:
+        subject, sender = message_headers(msg)
+        snippet = msg.get("snippet", "")
+        otp = extract_otp(subject, snippet)
+        found.append({
+            "id": msg["id"],
+            "timestamp": int(msg.get("internalDate", 0)),
+            "otp": otp,
+            "sender": sender,
+            "subject": subject,
+            "snippet": snippet,
+        })
+        if not otp and looks_like_otp_mail(f"{subject} {snippet}"):
+            escalate.append(msg["id"])
+    
+    if escalate:
+        with TRACER.span("escalate", messages=len(escalate)):
+            bodies = {
+                msg["id"]: msg
+                for msg in batch_get_messages(service, escalate, format='full', fields=OTP_BODY_FIELDS)
+            }
+        for item in found:
+            if item["id"] in bodies:
+                payload = bodies[item["id"]].get("payload", {})
+                item["otp"] = extract_otp(item["subject"], item["snippet"], payload)
+    
+    return found
+
+def schedule_auto_delete(chat_id, message_id, delay_seconds=60):
+    DELETER.schedule(chat_id, message_id, delay_seconds)
 
 async def send_auto_delete_message(chat_id, text, parse_mode=None, reply_markup=None, delete_after=60):
-    message = await telegram_app.bot.send_message(
-        chat_id=chat_id,
-        text=text,
+    message = await DISPATCHER.send(
+        chat_id,
+        text,
         parse_mode=parse_mode,
         reply_markup=reply_markup
     )
-    asyncio.create_task(schedule_auto_delete(chat_id, message.message_id, delete_after))
+    schedule_auto_delete(chat_id, message.message_id, delete_after)
     return message
 
-async def fetch_latest_otp(chat_id):
+def format_otp_notification(items):
+    from telegram.helpers import escape_markdown
+    
+    # Senders and subjects come from whoever mailed the user; a stray _ or * in
+    # them would otherwise break the Markdown and get the whole message rejected.
+    if len(items) == 1:
+        found = items[0]
+        sender_info = f"\n📨 From: {escape_markdown(found['sender'])}" if found["sender"] else ""
+        subject_info = f"\n📝 Subject: {escape_markdown(found['subject'])}" if found["subject"] else ""
+        return f"🚨 New OTP Received!\n\n🔢 Code: `{found['otp']}`{sender_info}{subject_info}\n\n⏰ Auto-deletes in 2 minutes"
+    
+    lines = []
+    for found in sorted(items, key=lambda f: f["timestamp"], reverse=True):
+        sender_info = f" — {escape_markdown(found['sender'])}" if found["sender"] else ""
+        lines.append(f"🔢 `{found['otp']}`{sender_info}")
+    return f"🚨 {len(items)} New OTPs Received!\n\n" + "\n".join(lines) + "\n\n⏰ Auto-deletes in 2 minutes"
+
+def find_latest_otp(service):
+    after_timestamp = int(time.time()) - QUERY_WINDOW_SECONDS
+    query = f"is:unread after:{after_timestamp}"
+    
+    msgs = service.users().messages().list(
+        userId="me", 
+        q=query,
+        maxResults=5
+    ).execute().get("messages", [])
+    
+    found_otps = [found for found in fetch_otp_messages(service, [m["id"] for m in msgs]) if found["otp"]]
+    if found_otps:
+        latest = max(found_otps, key=lambda found: found["timestamp"])
+        mark_messages_read(service, [latest["id"]])
+    
+    return found_otps
+
+def remember_otps(data, found_otps):
+    # Newest first, at most RECENT_OTP_LIMIT, none older than the button looks back.
+    cutoff = (time.time() - QUERY_WINDOW_SECONDS) * 1000
+    recent = {item["id"]: item for item in data.get("recent_otps", [])}
+    for found in found_otps:
+        recent[found["id"]] = {key: found[key] for key in ("id", "otp", "sender", "subject", "timestamp")}
+    kept = sorted((item for item in recent.values() if item["timestamp"] >= cutoff),
+                  key=lambda item: item["timestamp"], reverse=True)
+    # Replaced rather than changed in place, so flush() never sees a list mid-update.
+    data["recent_otps"] = kept[:RECENT_OTP_LIMIT]
+
+def latest_remembered_otp(data):
+    cutoff = (time.time() - QUERY_WINDOW_SECONDS) * 1000
+    recent = [item for item in data.get("recent_otps", []) if item["timestamp"] >= cutoff]
+    return recent[0] if recent else None
+
+def lookup_latest_otp(chat_id):
     email, data = get_user_by_chat_id(chat_id)
     if not email or not data:
         return None, None, None, None
     
+    if ROLE == "web":
+        # The poll workers keep the cache; take what they last flushed.
+        data = ACCOUNTS.reload(email)[0] or data
+    
+    # Everything the poller has seen is in recent_otps, so while its last poll is
+    # recent enough the answer comes from memory. Gmail is only asked when there
+    # is nothing cached or the account hasn't been polled lately.
+    cached = latest_remembered_otp(data)
+    if cached and time.time() - data.get("checked_at", 0) <= RECENT_OTP_FRESH_SECONDS:
+        RECENT_OTP_LOOKUPS.inc(source="cache")
+        return email, cached["otp"], cached["sender"], cached["subject"]
+    
     try:
-        creds = creds_from_dict(data["creds"])
-        if not creds.valid and creds.refresh_token:
-            creds.refresh(Request())
-            data["creds"] = creds_to_dict(creds)
+        with gmail_service(email) as service:
+            found_otps = find_latest_otp(service)
+        RECENT_OTP_LOOKUPS.inc(source="gmail")
         
-        service = build("gmail", "v1", credentials=creds)
+        if found_otps:
+            remember_otps(data, found_otps)
+            # In the web role the worker owns this row; don't overwrite its state.
+            if ROLE != "web":
+                ACCOUNTS.mark_dirty(email)
+        latest = latest_remembered_otp(data)
         
-        after_timestamp = int((datetime.now() - timedelta(hours=1)).timestamp() * 1000)
-        query = f"is:unread after:{after_timestamp}"
-        
-        msgs = service.users().messages().list(
-            userId="me", 
-            q=query,
-            maxResults=5
-        ).execute().get("messages", [])
-        
-        latest_otp = None
-        latest_timestamp = 0
-        latest_sender = ""
-        latest_subject = ""
-        
-        for m in msgs:
-            mid = m["id"]
-            msg = service.users().messages().get(userId="me", id=mid, format='full').execute()
-            
-            timestamp = int(msg.get("internalDate", 0))
-            
-            headers = msg.get("payload", {}).get("headers", [])
-            subject = ""
-            sender = ""
-            
-            for header in headers:
-                if header.get("name", "").lower() == "subject":
-                    subject = header.get("value", "")
-                if header.get("name", "").lower() == "from":
-                    sender = header.get("value", "")
-            
-            snippet = msg.get("snippet", "")
-            otps = extract_otps(snippet)
-            
-            if otps and timestamp > latest_timestamp:
-                latest_otp = otps[0]
-                latest_timestamp = timestamp
-                latest_sender = sender
-                latest_subject = subject
-                
-                try:
-                    service.users().messages().modify(
-                        userId="me", 
-                        id=mid, 
-                        body={"removeLabelIds": ["UNREAD"]}
-                    ).execute()
-                except:
-                    pass
-        
-        if latest_otp:
-            return email, latest_otp, latest_sender, latest_subject
+        if latest:
+            return email, latest["otp"], latest["sender"], latest["subject"]
         else:
             return email, None, None, None
         
     except Exception as e:
         print(f"Error fetching OTP: {e}")
+        if cached:
+            return email, cached["otp"], cached["sender"], cached["subject"]
         return None, None, None, None
 
+async def run_blocking(func, *args):
+    # In the web role button presses read and write SQLite, which can wait on
+    # the workers' write locks; that wait mustn't hold up every other chat.
+    return await asyncio.get_running_loop().run_in_executor(FETCH_EXECUTOR, func, *args)
+
+async def fetch_latest_otp(chat_id):
+    # Token refreshes and Gmail calls are blocking, so they run on FETCH_EXECUTOR
+    # instead of the bot's loop. Taps from a chat while its lookup is still
+    # running share that lookup rather than queueing another one.
+    chat_id = str(chat_id)
+    future = FETCH_IN_FLIGHT.get(chat_id)
+    if future is None:
+        future = asyncio.get_running_loop().run_in_executor(FETCH_EXECUTOR, lookup_latest_otp, chat_id)
+        FETCH_IN_FLIGHT[chat_id] = future
+        future.add_done_callback(lambda f: FETCH_IN_FLIGHT.pop(chat_id, None))
+    # A cancelled handler mustn't cancel the lookup other taps are waiting on.
+    return await asyncio.shield(future)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    
     chat_id = update.effective_chat.id
     
-    asyncio.create_task(schedule_auto_delete(chat_id, update.message.message_id, 30))
+    schedule_auto_delete(chat_id, update.message.message_id, 30)
     
     email, data = get_user_by_chat_id(chat_id)
     
@@ -206,6 +555,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    from telegram.helpers import escape_markdown
+    
     q = update.callback_query
     await q.answer()
     
@@ -215,6 +567,8 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         email, data = get_user_by_chat_id(chat_id)
         
         if email and data:
+            # The user is about to sign up somewhere; watch this inbox closely for a while.
+            await run_blocking(request_poll, email, True)
             mixed_email = generate_mixed_case_variation(email)
             keyboard = [
                 [InlineKeyboardButton("🔄 Generate New Email", callback_data="generate_connected")],
@@ -231,6 +585,9 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif q.data == "refresh_otp":
         await q.edit_message_text("🔍 Scanning for latest OTP...", parse_mode="Markdown")
+        email, data = get_user_by_chat_id(chat_id)
+        if email:
+            await run_blocking(request_poll, email, True)
         email, otp, sender, subject = await fetch_latest_otp(chat_id)
         
         if email and otp:
@@ -240,8 +597,8 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 [InlineKeyboardButton("📊 Stats", callback_data="stats")]
             ]
             
-            sender_info = f"\n📨 From: {sender}" if sender else ""
-            subject_info = f"\n📝 Subject: {subject}" if subject else ""
+            sender_info = f"\n📨 From: {escape_markdown(sender)}" if sender else ""
+            subject_info = f"\n📝 Subject: {escape_markdown(subject)}" if subject else ""
             
             await q.edit_message_text(
                 f"✅ OTP Found!\n\n🔢 Your Code: `{otp}`{sender_info}{subject_info}\n\n⏰ Auto-deletes in 2 minutes",
@@ -267,6 +624,9 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif q.data == "stats":
         email, data = get_user_by_chat_id(chat_id)
         if email:
+            if ROLE == "web":
+                # The count is kept by whichever worker polls this account.
+                data = (await run_blocking(ACCOUNTS.reload, email))[0] or data
             otp_count = data.get("otp_count", 0)
             keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="back_main")]]
             await q.edit_message_text(
@@ -280,7 +640,8 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif q.data == "logout":
         email, data = get_user_by_chat_id(chat_id)
         if email:
-            del USERS[email]
+            await run_blocking(ACCOUNTS.remove, email)
+            await run_blocking(disconnect_account, email)
             keyboard = [[InlineKeyboardButton("🔗 Connect New Account", url=f"{BASE_URL}/start_oauth/{chat_id}")]]
             await q.edit_message_text(
                 "✅ Logout Successful!\n\nYour Gmail account has been disconnected.",
@@ -325,7 +686,7 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     if update.message and not update.message.text.startswith('/'):
-        asyncio.create_task(schedule_auto_delete(chat_id, update.message.message_id, 30))
+        schedule_auto_delete(chat_id, update.message.message_id, 30)
 
 @app.route("/")
 def home():
@@ -337,6 +698,8 @@ def start_oauth(chat_id):
         return "Configuration Required - Please upload client_secret.json"
     
     try:
+        from google_auth_oauthlib.flow import Flow
+        
         session["chat_id"] = chat_id
         flow = Flow.from_client_secrets_file(
             OAUTH_CLIENT_SECRETS_FILE, 
@@ -353,9 +716,27 @@ def start_oauth(chat_id):
     except Exception as e:
         return f"Error: {str(e)}"
 
+def connect_account(email, chat_id, creds):
+    replaced = ACCOUNTS.add(email, chat_id, creds_to_dict(creds))
+    CREDENTIALS.add(email, creds)
+    # A reconnect brings a new token; whatever backoff or open circuit the old
+    # one earned mustn't keep the account paused.
+    QUOTA.remove(email)
+    if ROLE == "web":
+        ACCOUNTS.queue_poll_request(email, boost=True)
+    else:
+        SCHEDULER.add(email, delay=0)
+    if replaced:
+        disconnect_account(replaced)
+    return replaced
+
 @app.route("/oauth2callback")
 def oauth2callback():
     try:
+        from google_auth_oauthlib.flow import Flow
+        from googleapiclient.discovery import build
+        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+        
         state = session.get("state")
         flow = Flow.from_client_secrets_file(
             OAUTH_CLIENT_SECRETS_FILE, 
@@ -372,151 +753,697 @@ def oauth2callback():
         if not chat_id:
             return "Session expired. Please try again from Telegram."
         
-        USERS[email] = {"chat_id": chat_id, "creds": creds_to_dict(creds), "seen": set(), "otp_count": 0}
+        connect_account(email, chat_id, creds)
         
-        if telegram_app and telegram_loop:
+        if DISPATCHER:
             keyboard = [
                 [InlineKeyboardButton("🔄 Generate New Email", callback_data="generate_connected")],
                 [InlineKeyboardButton("🔍 Check Latest OTP", callback_data="refresh_otp")],
                 [InlineKeyboardButton("📊 Stats", callback_data="stats")]
             ]
-            asyncio.run_coroutine_threadsafe(
-                telegram_app.bot.send_message(
-                    chat_id=chat_id, 
-                    text=f"✅ Connected Successfully!\n\n📧 Email: `{email}`\n\n✨ 24/7 Online on Render.com!",
-                    parse_mode="Markdown",
-                    reply_markup=InlineKeyboardMarkup(keyboard)
-                ),
-                telegram_loop
+            DISPATCHER.send_threadsafe(
+                chat_id,
+                f"✅ Connected Successfully!\n\n📧 Email: `{email}`\n\n✨ 24/7 Online on Render.com!",
+                parse_mode="Markdown",
+                reply_markup=InlineKeyboardMarkup(keyboard)
             )
         
         return "Successfully connected! Return to Telegram."
     except Exception as e:
         return f"Authentication failed: {str(e)}"
 
+@app.route("/gmail/push", methods=["POST"])
+def gmail_push():
+    if PUSH_VERIFICATION_TOKEN and not hmac.compare_digest(request.args.get("token", ""), PUSH_VERIFICATION_TOKEN):
+        return "Forbidden", 403
+    
+    try:
+        envelope = request.get_json(force=True)
+        notification = json.loads(base64.b64decode(envelope["message"]["data"]))
+        email = notification["emailAddress"]
+    except Exception as e:
+        # Acknowledge anyway; Pub/Sub would otherwise redeliver a message we can never parse.
+        print(f"Bad push notification: {e}")
+        return "", 204
+    
+    if email in ACCOUNTS:
+        request_poll(email)
+    return "", 204
+
+def metrics_authorized():
+    return not METRICS_TOKEN or hmac.compare_digest(request.args.get("token", ""), METRICS_TOKEN)
+
+@app.route("/metrics")
+def prometheus_metrics():
+    if not metrics_authorized():
+        return "Forbidden", 403
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/debug/traces")
+def debug_traces():
+    # Traces name the accounts they polled, so unlike /metrics this is never public.
+    if not METRICS_TOKEN or not metrics_authorized():
+        return "Forbidden", 403
+    if not TRACER.enabled:
+        return jsonify({"enabled": False, "hint": "set TRACE_SLOW_SECONDS to record slow polls"})
+    return jsonify({"enabled": True, "slow_seconds": TRACER.slow_seconds, "traces": TRACER.recent()})
+
+def full_sync_messages(service, data):
+    # Take the history cursor before searching so nothing arriving mid-search is skipped.
+    history_id = service.users().getProfile(userId="me").execute().get("historyId")
+    
+    after_timestamp = int(time.time()) - QUERY_WINDOW_SECONDS
+    query = f"is:unread after:{after_timestamp}"
+    
+    msgs = service.users().messages().list(
+        userId="me", 
+        q=query,
+        maxResults=3
+    ).execute().get("messages", [])
+    return msgs, history_id
+
+def list_new_messages(service, data):
+    history_id = data.get("history_id")
+    if not history_id:
+        return full_sync_messages(service, data)
+    
+    msgs = []
+    page_token = None
+    try:
+        while True:
+            response = service.users().history().list(
+                userId="me",
+                startHistoryId=history_id,
+                historyTypes=["messageAdded"],
+                labelId="INBOX",
+                pageToken=page_token
+            ).execute()
+            for record in response.get("history", []):
+                for added in record.get("messagesAdded", []):
+                    message = added.get("message", {})
+                    if "UNREAD" in message.get("labelIds", []):
+                        msgs.append(message)
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+    except HttpError as e:
+        # Gmail only keeps history for a limited time; an expired cursor answers 404.
+        if e.resp.status == 404:
+            print("History expired, running full resync")
+            return full_sync_messages(service, data)
+        raise
+    
+    return msgs, response.get("historyId", history_id)
+
+def ensure_watch(email, service, data):
+    expiration = data.get("watch_expiration", 0)
+    if expiration - time.time() * 1000 > WATCH_RENEW_BEFORE_SECONDS * 1000:
+        return
+    if data.get("watch_retry_at", 0) > time.time():
+        return
+    request = service.users().watch(
+        userId="me",
+        body={"topicName": GMAIL_PUSH_TOPIC, "labelIds": ["INBOX"], "labelFilterAction": "include"}
+    )
+    # A missing topic or publish permission answers 403 too; that's our setup, not the
+    # account, so it mustn't open the account's circuit.
+    request.track_failures = False
+    try:
+        response = request.execute()
+    except GmailUnavailable:
+        raise
+    except Exception as e:
+        # Push is an optimisation; keep polling without it and try again later.
+        data["watch_retry_at"] = time.time() + WATCH_RETRY_SECONDS
+        print(f"⚠️ Gmail watch failed for {email}, retrying in {WATCH_RETRY_SECONDS}s: {e}")
+        return
+    data.pop("watch_retry_at", None)
+    data["watch_expiration"] = int(response.get("expiration", 0))
+    print(f"📡 Gmail watch {'renewed' if expiration else 'registered'} for {email}")
+
+def stop_watch(email):
+    # Otherwise Gmail keeps publishing a disconnected account's mail to our topic until the watch expires.
+    if not GMAIL_PUSH_TOPIC:
+        return
+    try:
+        with gmail_service(email) as service:
+            request = service.users().stop(userId="me")
+            request.track_failures = False
+            request.execute()
+        print(f"📡 Gmail watch stopped for {email}")
+    except Exception as e:
+        print(f"⚠️ Couldn't stop Gmail watch for {email}: {e}")
+
+def poll_account(email, data):
+    deadline = time.monotonic() + POLL_ACCOUNT_TIMEOUT_SECONDS
+    
+    with gmail_service(email) as service:
+        if GMAIL_PUSH_TOPIC:
+            with TRACER.span("ensure_watch"):
+                ensure_watch(email, service, data)
+        
+        with TRACER.span("list"):
+            msgs, history_id = list_new_messages(service, data)
+        
+        new_ids = [m["id"] for m in msgs if m["id"] not in data["seen"]]
+        if time.monotonic() > deadline:
+            # Leave the history cursor where it was so these are listed again next cycle.
+            print(f"Polling timeout for {email}, resuming next cycle")
+            return 0
+        
+        read_ids = []
+        with TRACER.span("fetch", messages=len(new_ids)):
+            found_messages = fetch_otp_messages(service, new_ids)
+        if DISPATCHER is None and any(found["otp"] for found in found_messages):
+            # Nothing to send them with yet; keep the cursor so they're listed again.
+            return 0
+        for found in found_messages:
+            mid = found["id"]
+            
+            if found["otp"]:
+                data["otp_count"] = data.get("otp_count", 0) + 1
+                # Queued OTPs for the same chat go out together as one message.
+                DISPATCHER.send_threadsafe(
+                    data["chat_id"],
+                    group="otp",
+                    item=found,
+                    callback=lambda message, found=found: otp_delivered(found, message),
+                    parse_mode="Markdown"
+                )
+                
+                read_ids.append(mid)
+                data["seen"].add(mid, found["timestamp"])
+        
+        with TRACER.span("mark_read", messages=len(read_ids)):
+            mark_messages_read(service, read_ids)
+        remember_otps(data, [found for found in found_messages if found["otp"]])
+        data["checked_at"] = time.time()
+        data["seen"].prune()
+        data["history_id"] = history_id
+        # If the shard moved away mid-poll, the new owner's state wins.
+        if email in SCHEDULER:
+            ACCOUNTS.mark_dirty(email)
+        return len(read_ids)
+
+def otp_delivered(found, message):
+    if found["timestamp"]:
+        OTP_DELIVERY_SECONDS.observe(max(0.0, time.time() - found["timestamp"] / 1000))
+    schedule_auto_delete(message.chat_id, message.message_id, OTP_DELETE_SECONDS)
+
+def run_poll_account(email, data):
+    started = time.monotonic()
+    outcome = "ok"
+    try:
+        with TRACER.trace("poll", email=email):
+            return poll_account(email, data)
+    except GmailUnavailable:
+        outcome = "paused"
+        return 0
+    except Exception as e:
+        outcome = "error"
+        print(f"Polling error for {email}: {e}")
+        return 0
+    finally:
+        elapsed = time.monotonic() - started
+        POLL_STATS["polls"] += 1
+        POLL_STATS["last_poll_seconds"] = elapsed
+        POLLS.inc(outcome=outcome)
+        POLL_SECONDS.observe(elapsed)
+
+def submit_poll(email, data, rerun=True):
+    wait = QUOTA.wait_time(email)
+    if wait > 0:
+        # Backing off or circuit open: don't spend a worker on it until then.
+        SCHEDULER.defer(email, wait)
+        return None
+    with POLL_LOCK:
+        future = POLL_IN_FLIGHT.get(email)
+        if future is not None:
+            # A poll already running may have listed before the new mail landed; go again after it.
+            if rerun:
+                POLL_RERUN.add(email)
+            return None
+        future = POLL_EXECUTOR.submit(run_poll_account, email, data)
+        POLL_IN_FLIGHT[email] = future
+    future.add_done_callback(lambda f: poll_done(email, data, f))
+    return future
+
+def poll_done(email, data, future):
+    with POLL_LOCK:
+        POLL_IN_FLIGHT.pop(email, None)
+        rerun = email in POLL_RERUN
+        POLL_RERUN.discard(email)
+    SCHEDULER.record(email, activity=bool(future.result()))
+    if rerun and email in ACCOUNTS:
+        submit_poll(email, data)
+
+def request_poll(email, boost=False):
+    if ROLE == "web":
+        ACCOUNTS.queue_poll_request(email, boost)
+        return
+    data = ACCOUNTS.get(email)
+    if data is None:
+        return
+    if boost:
+        SCHEDULER.boost(email)
+    else:
+        submit_poll(email, data)
+
+def report_poll_stats(window_started, window_polls):
+    elapsed = time.monotonic() - window_started
+    tiers = SCHEDULER.tiers()
+    lag = POLL_STATS["max_lag_seconds"]
+    status = "✅" if lag <= POLL_INTERVAL_SECONDS else "⚠️ behind schedule"
+    print(f"Poller: {POLL_STATS['polls'] - window_polls} polls in {elapsed:.0f}s, "
+          f"hot/warm/cold {tiers['hot']}/{tiers['warm']}/{tiers['cold']}, "
+          f"max lag {lag:.2f}s, {len(POLL_IN_FLIGHT)} in flight {status}")
+    paused = QUOTA.paused_counts()
+    if paused["backoff"] or paused["circuit_open"]:
+        print(f"Gmail: {paused['backoff']} accounts backing off, {paused['circuit_open']} circuits open, "
+              f"{QUOTA.units_used} quota units used")
+    if DISPATCHER:
+        outbox = DISPATCHER.stats()
+        print(f"Outbox: depth {outbox['queue_depth']}, sent {outbox['sent']}, "
+              f"coalesced {outbox['coalesced']}, 429s {outbox['rate_limited']}, "
+              f"p50 send {outbox['send_latency_p50']:.2f}s")
+
 def poll():
-    print("Starting Gmail polling service on Render.com...")
+    mode = "push + safety-net" if GMAIL_PUSH_TOPIC else "polling"
+    print(f"Starting Gmail polling service on Render.com ({mode}, base every {SCHEDULER.base_interval}s)...")
+    window_started = time.monotonic()
+    window_polls = POLL_STATS["polls"]
     while True:
         try:
-            for email, data in list(USERS.items()):
-                try:
-                    creds = creds_from_dict(data["creds"])
-                    if not creds.valid and creds.refresh_token:
-                        creds.refresh(Request())
-                        data["creds"] = creds_to_dict(creds)
-                    
-                    service = build("gmail", "v1", credentials=creds)
-                    
-                    after_timestamp = int((datetime.now() - timedelta(hours=1)).timestamp() * 1000)
-                    query = f"is:unread after:{after_timestamp}"
-                    
-                    msgs = service.users().messages().list(
-                        userId="me", 
-                        q=query,
-                        maxResults=3
-                    ).execute().get("messages", [])
-                    
-                    for m in msgs:
-                        mid = m["id"]
-                        if mid in data["seen"]:
-                            continue
-                        
-                        msg = service.users().messages().get(userId="me", id=mid, format='full').execute()
-                        
-                        headers = msg.get("payload", {}).get("headers", [])
-                        subject = ""
-                        sender = ""
-                        
-                        for header in headers:
-                            if header.get("name", "").lower() == "subject":
-                                subject = header.get("value", "")
-                            if header.get("name", "").lower() == "from":
-                                sender = header.get("value", "")
-                        
-                        snippet = msg.get("snippet", "")
-                        otps = extract_otps(snippet)
-                        
-                        if otps and telegram_app and telegram_loop:
-                            otp = otps[0]
-                            data["otp_count"] = data.get("otp_count", 0) + 1
-                            
-                            sender_info = f"\n📨 From: {sender}" if sender else ""
-                            subject_info = f"\n📝 Subject: {subject}" if subject else ""
-                            
-                            asyncio.run_coroutine_threadsafe(
-                                telegram_app.bot.send_message(
-                                    chat_id=int(data["chat_id"]), 
-                                    text=f"🚨 New OTP Received!\n\n🔢 Code: `{otp}`{sender_info}{subject_info}\n\n⏰ Auto-deletes in 2 minutes",
-                                    parse_mode="Markdown"
-                                ),
-                                telegram_loop
-                            )
-                            
-                            try:
-                                service.users().messages().modify(
-                                    userId="me", 
-                                    id=mid, 
-                                    body={"removeLabelIds": ["UNREAD"]}
-                                ).execute()
-                            except:
-                                pass
-                            
-                            data["seen"].add(mid)
-                            
-                except Exception as e:
-                    print(f"Polling error for {email}: {e}")
+            for email, lag in SCHEDULER.wait_due():
+                data = ACCOUNTS.get(email)
+                if data is None:
+                    SCHEDULER.remove(email)
+                    continue
+                POLL_STATS["max_lag_seconds"] = max(POLL_STATS["max_lag_seconds"], lag)
+                POLL_LAG_SECONDS.observe(lag)
+                # Already in flight (e.g. push-triggered): its completion reschedules the account.
+                submit_poll(email, data, rerun=False)
             
-            time.sleep(POLL_INTERVAL_SECONDS)
+            if time.monotonic() - window_started >= POLL_STATS_INTERVAL_SECONDS:
+                report_poll_stats(window_started, window_polls)
+                window_started = time.monotonic()
+                window_polls = POLL_STATS["polls"]
+                POLL_STATS["max_lag_seconds"] = 0.0
         except Exception as e:
             print(f"Polling loop error: {e}")
-            time.sleep(POLL_INTERVAL_SECONDS)
+            time.sleep(1)
+
+def restore_accounts(schedule=True):
+    started = time.monotonic()
+    if schedule:
+        load_saved_state()
+    for email, creds in ACCOUNTS.load().items():
+        CREDENTIALS.add(email, creds)
+        if schedule:
+            schedule_account(email)
+    print(f"📦 Restored {len(ACCOUNTS)} accounts in {time.monotonic() - started:.2f}s")
+
+def snapshot_accounts():
+    accounts = {}
+    for email, (due_in, interval, hot_for) in SCHEDULER.export().items():
+        data = ACCOUNTS.get(email) or {}
+        accounts[email] = [round(due_in, 1), interval, round(hot_for, 1), data.get("watch_expiration", 0)]
+    return accounts
+
+def load_saved_state():
+    global SAVED_STATE
+    saved, age = SNAPSHOT.load()
+    SAVED_STATE = {}
+    for email, entry in saved.items():
+        try:
+            due_in, interval, hot_for, watch_expiration = entry
+            SAVED_STATE[email] = (due_in - age, interval, hot_for - age, watch_expiration)
+        except (TypeError, ValueError):
+            continue
+    if SAVED_STATE:
+        print(f"💾 Poll state for {len(SAVED_STATE)} accounts restored from a {age:.0f}s old snapshot")
+
+def schedule_account(email):
+    saved = SAVED_STATE.pop(email, None)
+    if saved is None:
+        SCHEDULER.add(email)
+        return
+    due_in, interval, hot_for, watch_expiration = saved
+    data = ACCOUNTS.get(email)
+    if data is not None and not data.get("watch_expiration"):
+        data["watch_expiration"] = watch_expiration
+    if due_in <= 0 and hot_for <= 0:
+        # Came due while we were down; spread these out like a fresh start would.
+        due_in = random.uniform(0, SCHEDULER.base_interval)
+    SCHEDULER.restore(email, due_in, interval, hot_for)
 
 def start_poll():
     threading.Thread(target=poll, daemon=True).start()
 
+def adopt_account(email):
+    # Start from what the previous owner last flushed, not our stale copy.
+    data, creds = ACCOUNTS.reload(email)
+    if data is None:
+        return
+    CREDENTIALS.add(email, creds)
+    schedule_account(email)
+
+def release_account(email):
+    SCHEDULER.remove(email)
+    CREDENTIALS.remove(email)
+    QUOTA.remove(email)
+    drop_gmail_service(email)
+    # A worker only keeps the shards it holds loaded; adopt_account() reads it back if it returns.
+    ACCOUNTS.evict(email)
+
+def disconnect_account(email):
+    # Unlike a shard moving to another worker, the account is gone for good.
+    stop_watch(email)
+    release_account(email)
+
+def sync_shards():
+    listed, removed, reconnected = ACCOUNTS.refresh()
+    for email in removed:
+        release_account(email)
+    for email in reconnected:
+        # The old token may be the revoked one; don't keep polling (or backing off) with it.
+        data, creds = ACCOUNTS.reload(email)
+        if data is not None:
+            CREDENTIALS.add(email, creds)
+            QUOTA.remove(email)
+            drop_gmail_service(email)
+    
+    # Hand our latest state over before any of our shards can move to another worker.
+    ACCOUNTS.flush()
+    before = set(LEASES.owned)
+    owned = LEASES.heartbeat(time.time())
+    
+    for email in listed:
+        if LEASES.owns(email):
+            if email not in SCHEDULER:
+                adopt_account(email)
+        elif email in SCHEDULER:
+            release_account(email)
+    
+    if owned != before:
+        print(f"🧩 Worker {LEASES.worker_id}: {len(owned)}/{SHARD_COUNT} shards, {len(SCHEDULER)} accounts")
+
+def shard_loop():
+    last_sync = 0
+    while True:
+        try:
+            if time.monotonic() - last_sync >= SHARD_HEARTBEAT_SECONDS:
+                sync_shards()
+                last_sync = time.monotonic()
+            for email, boost in ACCOUNTS.take_poll_requests(lambda email: email in SCHEDULER):
+                request_poll(email, boost)
+        except Exception as e:
+            print(f"Shard sync error: {e}")
+        time.sleep(1)
+
+def process_share(total):
+    # Telegram's flood limit and Gmail's project quota are shared by every process.
+    if ROLE == "all":
+        return total
+    return total / (max(1, POLL_PROCESSES) + 1)
+
 telegram_bot = None
 telegram_loop = None
 telegram_app = None
+BOT_READY = None
+DISPATCHER = None
+DELETER = None
+
+def build_telegram(loop, handle_updates=True, journal=DELETE_JOURNAL):
+    global telegram_loop, telegram_app, DISPATCHER, DELETER
+    
+    from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+    from telegram_dispatcher import OutboundDispatcher
+    from delete_scheduler import DeleteScheduler
+    
+    telegram_loop = loop
+    builder = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot")
+    if SERVER_MODE == "asgi":
+        # Updates arrive through the webhook route; there is nothing to poll.
+        builder = builder.updater(None)
+    telegram_app = builder.build()
+    if handle_updates:
+        telegram_app.add_handler(CommandHandler("start", start))
+        telegram_app.add_handler(CallbackQueryHandler(button))
+        telegram_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    
+    DISPATCHER = OutboundDispatcher(
+        telegram_app.bot, telegram_loop,
+        global_rate=process_share(TELEGRAM_GLOBAL_RATE),
+        on_sent=TELEGRAM_SEND_SECONDS.observe
+    )
+    DISPATCHER.register_formatter("otp", format_otp_notification)
+    DELETER = DeleteScheduler(telegram_app.bot, journal)
+
+async def start_bot(handle_updates=True):
+    DISPATCHER.start()
+    DELETER.start()
+    print(f"🧹 {DELETER.pending_count()} pending auto-deletes restored")
+    await telegram_app.initialize()
+    if not handle_updates:
+        return
+    await telegram_app.start()
+    if SERVER_MODE == "asgi":
+        from telegram import Update
+        
+        await telegram_app.bot.set_webhook(
+            url=f"{BASE_URL}{TELEGRAM_WEBHOOK_PATH}",
+            secret_token=webhook_secret(),
+            allowed_updates=Update.ALL_TYPES
+        )
+        print("🤖 Bot started on Render.com (webhook) - 24/7 Online!")
+    else:
+        await telegram_app.updater.start_polling()
+        print("🤖 Bot started on Render.com - 24/7 Online!")
+
+def start_telegram(handle_updates=True, journal=DELETE_JOURNAL):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    build_telegram(loop, handle_updates, journal)
+    loop.create_task(start_bot(handle_updates))
+    
+    def run_async_loop():
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+    
+    threading.Thread(target=run_async_loop, daemon=True).start()
+
+def webhook_secret():
+    # Telegram echoes this back on every webhook call; derive a stable one if none is configured.
+    return TELEGRAM_WEBHOOK_SECRET or hashlib.sha256(f"webhook:{TELEGRAM_BOT_TOKEN}".encode()).hexdigest()[:32]
+
+async def asgi_respond(send, status, body=b"", content_type=b"text/plain"):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type)]})
+    await send({"type": "http.response.body", "body": body})
+
+async def telegram_webhook(scope, receive, send):
+    if scope["method"] != "POST":
+        return await asgi_respond(send, 405)
+    headers = dict(scope["headers"])
+    secret = headers.get(b"x-telegram-bot-api-secret-token", b"").decode("latin-1")
+    if not hmac.compare_digest(secret, webhook_secret()):
+        return await asgi_respond(send, 403, b"Forbidden")
+    
+    from telegram import Update
+    
+    # With FAST_START the first update can beat the bot's startup; hold it until then.
+    await BOT_READY.wait()
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    
+    try:
+        update = Update.de_json(json.loads(body), telegram_app.bot)
+    except Exception as e:
+        # Acknowledge anyway; Telegram would otherwise keep redelivering it.
+        print(f"Bad webhook update: {e}")
+        return await asgi_respond(send, 200)
+    # Handlers run on this same loop; answer Telegram straight away.
+    await telegram_app.update_queue.put(update)
+    await asgi_respond(send, 200)
+
+async def start_asgi_services():
+    # Imports and reading accounts block, so they run off the loop.
+    await asyncio.get_running_loop().run_in_executor(None, restore_state)
+    build_telegram(asyncio.get_running_loop())
+    await start_bot()
+    start_background()
+    BOT_READY.set()
+
+async def fast_start_asgi_services():
+    try:
+        await start_asgi_services()
+    except Exception as e:
+        print(f"❌ Error starting: {e}")
+        os._exit(1)
+
+async def asgi_lifespan(receive, send):
+    global BOT_READY
+    
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            BOT_READY = asyncio.Event()
+            if FAST_START:
+                asyncio.get_running_loop().create_task(fast_start_asgi_services())
+            else:
+                try:
+                    await start_asgi_services()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # Leave the webhook registered: Telegram queues updates while we're down
+            # and its next call is what wakes a spun-down instance.
+            if BOT_READY.is_set():
+                await telegram_app.stop()
+                await telegram_app.shutdown()
+            ACCOUNTS.flush()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+def create_asgi_app():
+    from asgiref.wsgi import WsgiToAsgi
+    flask_app = WsgiToAsgi(app)
+    
+    async def asgi_app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await asgi_lifespan(receive, send)
+        if scope["type"] == "http" and scope["path"] == TELEGRAM_WEBHOOK_PATH:
+            return await telegram_webhook(scope, receive, send)
+        # OAuth, push and metrics routes stay Flask views, run on asgiref's thread pool.
+        return await flask_app(scope, receive, send)
+    
+    return asgi_app
+
+def start_background():
+    if ROLE == "all":
+        CREDENTIALS.start()
+        start_poll()
+    elif POLL_PROCESSES > 0:
+        threading.Thread(target=supervise_workers, args=(POLL_PROCESSES,), daemon=True).start()
+
+def worker_main(index=0):
+    global ROLE, LEASES, GMAIL_DISCOVERY_DOC
+    
+    if not TELEGRAM_BOT_TOKEN:
+        print("ERROR: TELEGRAM_BOT_TOKEN not set!")
+        return
+    
+    ROLE = "worker"
+    QUOTA.set_project_rate(process_share(GMAIL_PROJECT_UNITS_PER_SECOND))
+    # Let SIGTERM unwind through atexit so our leases are released, not left to expire.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    LEASES = ShardLeases(ACCOUNTS_DB, f"{socket.gethostname()}-{os.getpid()}", SHARD_COUNT, SHARD_LEASE_SECONDS)
+    
+    GMAIL_DISCOVERY_DOC = load_gmail_discovery()
+    # Accounts are only loaded, credentials and all, for shards we win (see adopt_account()).
+    ACCOUNTS.start()
+    # Saved poll state is applied as shards are adopted.
+    SNAPSHOT.path = f"{STATE_SNAPSHOT}.worker-{index}"
+    load_saved_state()
+    SNAPSHOT.start()
+    atexit.register(LEASES.release_all)
+    atexit.register(ACCOUNTS.flush)
+    atexit.register(SNAPSHOT.write)
+    CREDENTIALS.start()
+    
+    start_telegram(handle_updates=False, journal=f"{DELETE_JOURNAL}.worker-{index}")
+    if WORKER_METRICS_PORT:
+        METRICS.serve(WORKER_METRICS_PORT + index)
+    threading.Thread(target=shard_loop, daemon=True, name="shards").start()
+    print(f"🧩 Poll worker {index} started as {LEASES.worker_id}")
+    poll()
+
+def supervise_workers(count):
+    context = multiprocessing.get_context("spawn")
+    workers = {}
+    while True:
+        for index in range(count):
+            process = workers.get(index)
+            if process is not None and process.is_alive():
+                continue
+            if process is not None:
+                # Its shards are picked up by the others once the leases run out.
+                print(f"⚠️ Poll worker {index} exited with code {process.exitcode}, restarting")
+            process = context.Process(target=worker_main, args=(index,), name=f"poll-worker-{index}", daemon=True)
+            process.start()
+            workers[index] = process
+        time.sleep(5)
+
+def restore_state():
+    global telegram_bot, GMAIL_DISCOVERY_DOC
+    from telegram import Bot
+    
+    telegram_bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    print("✅ Telegram bot initialized")
+    
+    GMAIL_DISCOVERY_DOC = load_gmail_discovery()
+    restore_accounts(schedule=ROLE == "all")
+    ACCOUNTS.start()
+    atexit.register(ACCOUNTS.flush)
+    if ROLE == "all":
+        SNAPSHOT.start()
+        atexit.register(SNAPSHOT.write)
+
+def start_services():
+    restore_state()
+    # The dispatcher has to exist before the first poll finds anything to send.
+    start_telegram()
+    start_background()
+
+def fast_start_services():
+    try:
+        start_services()
+    except Exception as e:
+        print(f"❌ Error starting: {e}")
+        os._exit(1)
 
 def main():
-    global telegram_bot, telegram_loop, telegram_app
+    global ROLE
+    
+    role = sys.argv[1] if len(sys.argv) > 1 else SERVICE_ROLE
+    if role == "worker":
+        worker_main(int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+        return
     
     if not TELEGRAM_BOT_TOKEN:
         print("ERROR: TELEGRAM_BOT_TOKEN not set!")
         return
     
     try:
-        from telegram.ext import Application
-        
-        telegram_bot = Bot(token=TELEGRAM_BOT_TOKEN)
-        print("✅ Telegram bot initialized")
-        
-        start_poll()
+        ROLE = "web" if role == "web" or POLL_PROCESSES > 0 else "all"
+        QUOTA.set_project_rate(process_share(GMAIL_PROJECT_UNITS_PER_SECOND))
         
-        telegram_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(telegram_loop)
-        
-        telegram_app = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
-        telegram_app.add_handler(CommandHandler("start", start))
-        telegram_app.add_handler(CallbackQueryHandler(button))
-        telegram_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-        
-        async def start_bot():
-            await telegram_app.initialize()
-            await telegram_app.start()
-            await telegram_app.updater.start_polling()
-            print("🤖 Bot started on Render.com - 24/7 Online!")
-        
-        telegram_loop.create_task(start_bot())
-        
-        def run_async_loop():
-            asyncio.set_event_loop(telegram_loop)
-            telegram_loop.run_forever()
+        if SERVER_MODE == "asgi":
+            import uvicorn
+            
+            # Accounts, the bot, dispatcher and poller start from the ASGI lifespan, on uvicorn's loop.
+            print(f"🚀 Starting ASGI server on Render.com ({ROLE})...")
+            uvicorn.run(create_asgi_app(), host="0.0.0.0", port=PORT, lifespan="on", log_level="warning")
+            return
         
-        threading.Thread(target=run_async_loop, daemon=True).start()
+        if FAST_START:
+            # Health checks get answered while accounts load and the bot connects.
+            threading.Thread(target=fast_start_services, daemon=True, name="startup").start()
+        else:
+            start_services()
+        # Let SIGTERM unwind through atexit so account state and the snapshot get saved.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
         
-        print("🚀 Starting Flask server on Render.com...")
-        app.run(host="0.0.0.0", port=5000, debug=False)
+        print(f"🚀 Starting Flask server on Render.com ({ROLE})...")
+        app.run(host="0.0.0.0", port=PORT, debug=False)
         
     except Exception as e:
         print(f"❌ Error starting: {e}")
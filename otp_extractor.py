@@ -0,0 +1,139 @@
+import base64
+from bisect import bisect_left
+import html
+import re
+
+# One pass over the text finds keywords and every kind of candidate at once;
+# scoring then looks at what sits around each candidate.
+SCANNER = re.compile(
+    r"(?P<kw>\b(?:verification|verify|code|otp|one[- ]time|passcode|password|pin|security|"
+    r"authentication|2fa|login|log[- ]in|sign[- ]in|confirm(?:ation)?|token)\b)"
+    r"|(?P<split>(?<![\w-])\d{3}[ -]\d{3}(?![\w-]))"
+    r"|(?P<digits>(?<!\w)\d{4,8}(?!\w))"
+    r"|(?P<alnum>(?<![\w-])(?=[A-Z0-9]*\d)(?=[A-Z0-9]*[A-Z])[A-Z0-9]{5,8}(?![\w-]))",
+    re.IGNORECASE
+)
+PHONE_REGEX = re.compile(r"\+?\(?\d{2,4}\)?[ .-]\d{3,4}[ .-]\d{3,4}")
+NOISE_BEFORE_REGEX = re.compile(
+    r"(?:[$€£₹#]|\b(?:order|invoice|ref|reference|no|tel|phone|call|room|year|since|id)\b[ .:#]*)\s*$",
+    re.IGNORECASE
+)
+NOISE_AFTER_REGEX = re.compile(r"[.,/:]\d")
+HINT_REGEX = re.compile(
+    r"code|otp|verif|passcode|password|pin|one[- ]time|login|sign[- ]in", re.IGNORECASE
+)
+HTML_DROP_REGEX = re.compile(r"<(script|style|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+HTML_TAG_REGEX = re.compile(r"<[^>]+>")
+
+KEYWORD_BEFORE_WINDOW = 60
+KEYWORD_AFTER_WINDOW = 40
+CONFIDENT_SCORE = 6
+MIN_SCORE = 3
+MAX_PART_CHARS = 20000
+MAX_HTML_CHARS = 100000
+
+def looks_like_otp_mail(text):
+    return bool(HINT_REGEX.search(text or ""))
+
+def _base_score(kind, code):
+    if kind == "digits":
+        return 3 if len(code) == 6 else 2
+    if kind == "split":
+        return 3
+    # Uppercase alphanumeric codes need a keyword nearby to win over plain words.
+    return 1 if code.isupper() else -10
+
+def _noise_penalty(text, start, end, kind, code):
+    penalty = 0
+    before = text[max(0, start - 12):start]
+    after = text[end:end + 3]
+    if NOISE_BEFORE_REGEX.search(before):
+        penalty += 5
+    if NOISE_AFTER_REGEX.match(after) or before.endswith(("/", ":")):
+        # Prices, dates and times.
+        penalty += 5
+    if kind == "digits" and len(code) == 4 and code[:2] in ("19", "20"):
+        penalty += 2
+    for match in PHONE_REGEX.finditer(text, max(0, start - 16), min(len(text), end + 16)):
+        if match.start() <= start and end <= match.end() and match.group() != code:
+            penalty += 5
+            break
+    return penalty
+
+def find_candidates(text, context_bonus=0):
+    text = text or ""
+    keywords = []
+    found = []
+    for match in SCANNER.finditer(text):
+        kind = match.lastgroup
+        if kind == "kw":
+            keywords.append(match.start())
+        else:
+            found.append((kind, match))
+
+    candidates = []
+    for kind, match in found:
+        start, end = match.span()
+        code = match.group().replace(" ", "").replace("-", "")
+        score = _base_score(kind, match.group()) + context_bonus
+        # Keyword positions are sorted, so each proximity check is a bisect.
+        i = bisect_left(keywords, start)
+        if i > 0 and keywords[i - 1] >= start - KEYWORD_BEFORE_WINDOW:
+            score += 4
+        elif i < len(keywords) and keywords[i] <= end + KEYWORD_AFTER_WINDOW:
+            score += 3
+        score -= _noise_penalty(text, start, end, kind, code)
+        candidates.append((score, start, code))
+
+    candidates.sort(key=lambda c: (-c[0], c[1]))
+    return [(code, score) for score, _, code in candidates]
+
+def decode_part(data, max_chars=None):
+    if max_chars is not None:
+        # Only decode the head of large parts; codes sit near the top.
+        data = data[:(max_chars + 2) // 3 * 4]
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4)).decode("utf-8", "replace")
+
+def html_to_text(markup):
+    return html.unescape(HTML_TAG_REGEX.sub(" ", HTML_DROP_REGEX.sub(" ", markup)))
+
+def iter_text_parts(payload):
+    # text/plain parts come first, then text/html, decoding one part at a time.
+    plain = []
+    markup = []
+    stack = [payload or {}]
+    while stack:
+        part = stack.pop()
+        stack.extend(reversed(part.get("parts", [])))
+        data = part.get("body", {}).get("data")
+        mime_type = part.get("mimeType", "")
+        if data and mime_type == "text/plain":
+            plain.append(data)
+        elif data and mime_type == "text/html":
+            markup.append(data)
+
+    for data in plain:
+        yield decode_part(data, MAX_PART_CHARS)
+    for data in markup:
+        yield html_to_text(decode_part(data, MAX_HTML_CHARS))[:MAX_PART_CHARS]
+
+def extract_otp(subject="", snippet="", payload=None):
+    bonus = 1 if looks_like_otp_mail(subject) else 0
+    best_code, best_score = None, MIN_SCORE - 1
+
+    def consider(text):
+        nonlocal best_code, best_score
+        for code, score in find_candidates(text, bonus)[:1]:
+            if score > best_score:
+                best_code, best_score = code, score
+
+    consider(subject)
+    consider(snippet)
+    if best_score >= CONFIDENT_SCORE or payload is None:
+        return best_code
+
+    for text in iter_text_parts(payload):
+        consider(text)
+        if best_score >= CONFIDENT_SCORE:
+            break
+    return best_code
@@ -0,0 +1,130 @@
+import heapq
+import random
+import threading
+import time
+
+class PollScheduler:
+    # Min-heap of (next_due, seq, email). Rescheduling pushes a fresh entry and
+    # leaves the old one behind; pop_due() skips entries that no longer match.
+    #
+    # Tiers: an account boosted by a user action polls every hot_interval until
+    # hot_until; otherwise it polls every base_interval after activity and backs
+    # off by `backoff` per idle poll up to max_interval.
+    def __init__(self, base_interval, hot_interval=3, hot_duration=300, max_interval=120, backoff=1.5):
+        self.base_interval = base_interval
+        self.hot_interval = hot_interval
+        self.hot_duration = hot_duration
+        self.max_interval = max(max_interval, base_interval)
+        self.backoff = backoff
+        self._heap = []
+        self._due = {}
+        self._state = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def _push(self, email, due):
+        self._seq += 1
+        self._due[email] = due
+        heapq.heappush(self._heap, (due, self._seq, email))
+        self._cond.notify()
+
+    def add(self, email, delay=None):
+        with self._cond:
+            self._state.setdefault(email, {"interval": self.base_interval, "hot_until": 0})
+            if delay is None:
+                # Spread a batch of new accounts over one interval instead of polling all at once.
+                delay = random.uniform(0, self.base_interval)
+            self._push(email, time.monotonic() + delay)
+
+    def restore(self, email, due_in, interval, hot_for=0):
+        # Re-add an account with the tier and due time a previous process saved.
+        with self._cond:
+            now = time.monotonic()
+            self._state[email] = {
+                "interval": min(self.max_interval, max(self.hot_interval, interval)),
+                "hot_until": now + hot_for if hot_for > 0 else 0,
+            }
+            self._push(email, now + max(0.0, due_in))
+
+    def export(self):
+        # {email: (seconds until due, interval, seconds left hot)}; accounts being
+        # polled right now have no due time and come out as due immediately.
+        now = time.monotonic()
+        with self._cond:
+            return {
+                email: (max(0.0, self._due.get(email, now) - now), state["interval"], max(0.0, state["hot_until"] - now))
+                for email, state in self._state.items()
+            }
+
+    def remove(self, email):
+        with self._cond:
+            self._state.pop(email, None)
+            self._due.pop(email, None)
+
+    def boost(self, email, duration=None):
+        with self._cond:
+            state = self._state.get(email)
+            if state is None:
+                return
+            state["hot_until"] = time.monotonic() + (duration or self.hot_duration)
+            state["interval"] = self.hot_interval
+            self._push(email, time.monotonic())
+
+    def record(self, email, activity):
+        with self._cond:
+            state = self._state.get(email)
+            if state is None:
+                return
+            now = time.monotonic()
+            if now < state["hot_until"]:
+                state["interval"] = self.hot_interval
+            elif activity:
+                state["interval"] = self.base_interval
+            else:
+                state["interval"] = min(self.max_interval, max(self.base_interval, state["interval"] * self.backoff))
+            self._push(email, now + state["interval"])
+
+    def defer(self, email, delay):
+        with self._cond:
+            if email in self._state:
+                self._push(email, time.monotonic() + delay)
+
+    def pop_due(self, now=None):
+        now = time.monotonic() if now is None else now
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                at, _, email = heapq.heappop(self._heap)
+                if self._due.get(email) == at:
+                    del self._due[email]
+                    due.append((email, now - at))
+        return due
+
+    def wait_due(self, max_wait=1.0):
+        with self._cond:
+            if self._heap:
+                timeout = min(max_wait, max(0, self._heap[0][0] - time.monotonic()))
+            else:
+                timeout = max_wait
+            if timeout > 0:
+                self._cond.wait(timeout)
+        return self.pop_due()
+
+    def tiers(self):
+        now = time.monotonic()
+        counts = {"hot": 0, "warm": 0, "cold": 0}
+        with self._cond:
+            for state in self._state.values():
+                if now < state["hot_until"]:
+                    counts["hot"] += 1
+                elif state["interval"] <= self.base_interval:
+                    counts["warm"] += 1
+                else:
+                    counts["cold"] += 1
+        return counts
+
+    def __contains__(self, email):
+        return email in self._state
+
+    def __len__(self):
+        return len(self._state)
@@ -0,0 +1,53 @@
+import threading
+import time
+
+class SeenMessages:
+    # Message IDs grouped into fixed time buckets by internalDate. Whole buckets
+    # are dropped once they fall out of the window, so an account never holds
+    # more than a window's worth of IDs no matter how long the process runs.
+    def __init__(self, window_seconds=7200, bucket_seconds=300):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self._buckets = {}
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def add(self, message_id, internal_date_ms=None):
+        timestamp = internal_date_ms / 1000 if internal_date_ms else time.time()
+        bucket = int(timestamp // self.bucket_seconds)
+        with self._lock:
+            if message_id in self._index:
+                return
+            self._buckets.setdefault(bucket, set()).add(message_id)
+            self._index[message_id] = bucket
+        self.prune()
+
+    def __contains__(self, message_id):
+        return message_id in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def prune(self, now=None):
+        cutoff = int(((now or time.time()) - self.window_seconds) // self.bucket_seconds)
+        with self._lock:
+            expired = [bucket for bucket in self._buckets if bucket < cutoff]
+            for bucket in expired:
+                for message_id in self._buckets.pop(bucket):
+                    del self._index[message_id]
+        return len(expired)
+
+    def to_list(self):
+        with self._lock:
+            return [[message_id, bucket * self.bucket_seconds * 1000] for message_id, bucket in self._index.items()]
+
+    @classmethod
+    def from_list(cls, entries, **kwargs):
+        seen = cls(**kwargs)
+        for entry in entries:
+            # Older rows stored bare IDs; keep them for one window from now.
+            if isinstance(entry, str):
+                seen.add(entry)
+            else:
+                seen.add(entry[0], entry[1])
+        return seen
@@ -0,0 +1,99 @@
+import math
+import sqlite3
+import threading
+import zlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shard_leases (
+    shard INTEGER PRIMARY KEY,
+    owner TEXT,
+    expires_at REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS poll_workers (
+    worker_id TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL
+);
+"""
+
+def shard_of(email, shard_count):
+    return zlib.crc32(email.lower().encode("utf-8")) % shard_count
+
+class ShardLeases:
+    # Accounts hash onto a fixed ring of shards; poll workers hold time-limited
+    # leases on shards in the shared SQLite file. Each heartbeat renews what a
+    # worker holds, hands back anything above its fair share, and claims free or
+    # expired shards up to it. A worker that dies simply stops renewing, and its
+    # shards are picked up by the others within one lease period.
+    def __init__(self, path, worker_id, shard_count=64, lease_seconds=15):
+        self.worker_id = worker_id
+        self.shard_count = shard_count
+        self.lease_seconds = lease_seconds
+        self.owned = set()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._db.executemany(
+            "INSERT OR IGNORE INTO shard_leases (shard, owner, expires_at) VALUES (?, NULL, 0)",
+            [(shard,) for shard in range(shard_count)]
+        )
+
+    def owns(self, email):
+        return shard_of(email, self.shard_count) in self.owned
+
+    def heartbeat(self, now):
+        with self._lock:
+            return self._heartbeat(now)
+
+    def _heartbeat(self, now):
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO poll_workers (worker_id, heartbeat_at) VALUES (?, ?)",
+                (self.worker_id, now)
+            )
+            db.execute("DELETE FROM poll_workers WHERE heartbeat_at < ?", (now - self.lease_seconds,))
+            live = db.execute("SELECT COUNT(*) FROM poll_workers").fetchone()[0]
+            fair_share = math.ceil(self.shard_count / max(1, live))
+
+            db.execute(
+                "UPDATE shard_leases SET expires_at = ? WHERE owner = ?",
+                (now + self.lease_seconds, self.worker_id)
+            )
+            owned = [row[0] for row in db.execute(
+                "SELECT shard FROM shard_leases WHERE owner = ? ORDER BY shard", (self.worker_id,)
+            )]
+
+            if len(owned) > fair_share:
+                released = owned[fair_share:]
+                db.executemany(
+                    "UPDATE shard_leases SET owner = NULL, expires_at = 0 WHERE shard = ? AND owner = ?",
+                    [(shard, self.worker_id) for shard in released]
+                )
+                owned = owned[:fair_share]
+            elif len(owned) < fair_share:
+                free = [row[0] for row in db.execute(
+                    "SELECT shard FROM shard_leases WHERE owner IS NULL OR expires_at < ? ORDER BY shard LIMIT ?",
+                    (now, fair_share - len(owned))
+                )]
+                db.executemany(
+                    "UPDATE shard_leases SET owner = ?, expires_at = ? WHERE shard = ?",
+                    [(self.worker_id, now + self.lease_seconds, shard) for shard in free]
+                )
+                owned.extend(free)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+        self.owned = set(owned)
+        return self.owned
+
+    def release_all(self):
+        with self._lock:
+            self._db.execute(
+                "UPDATE shard_leases SET owner = NULL, expires_at = 0 WHERE owner = ?", (self.worker_id,)
+            )
+            self._db.execute("DELETE FROM poll_workers WHERE worker_id = ?", (self.worker_id,))
+            self.owned = set()
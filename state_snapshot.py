@@ -0,0 +1,50 @@
+import json
+import os
+import threading
+import time
+
+class StateSnapshot:
+    # Periodically writes the in-memory state that SQLite doesn't hold (poll
+    # tiers, due times, watch expirations) to one small JSON file, so a restart
+    # picks up where the last process left off. collect() returns {email: entry};
+    # the file is replaced atomically, so a crash mid-write keeps the old one.
+    def __init__(self, path, collect, interval=60):
+        self.path = path
+        self.collect = collect
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def load(self):
+        # Returns ({email: entry}, seconds since it was written).
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+            return snapshot["accounts"], max(0.0, time.time() - snapshot["written_at"])
+        except FileNotFoundError:
+            return {}, 0.0
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable state snapshot {self.path}: {e}")
+            return {}, 0.0
+
+    def write(self):
+        accounts = self.collect()
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w") as f:
+                json.dump({"written_at": time.time(), "accounts": accounts}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        return len(accounts)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="state-snapshot")
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except Exception as e:
+                print(f"State snapshot error: {e}")
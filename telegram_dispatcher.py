@@ -0,0 +1,216 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= 1
+
+def retry_after_seconds(error):
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+class OutboundDispatcher:
+    # All bot sends go through here, on the bot's event loop. Each chat has a
+    # FIFO of pending messages; senders take turns across chats while a global
+    # bucket and a per-chat bucket keep us under Telegram's flood limits. Items
+    # queued with the same group for the same chat are merged into one message
+    # by that group's formatter before they go out.
+    def __init__(self, bot, loop, global_rate=25, chat_rate=1, chat_burst=3, senders=8, max_attempts=5, on_sent=None):
+        self.bot = bot
+        self.loop = loop
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.senders = senders
+        self.max_attempts = max_attempts
+        self.on_sent = on_sent
+        self.formatters = {}
+        self._queues = {}
+        self._buckets = {}
+        self._blocked_until = {}
+        self._global_blocked_until = 0.0
+        self._ready = OrderedDict()
+        self._busy = set()
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.latencies = deque(maxlen=500)
+
+    def start(self):
+        self._tasks = [self.loop.create_task(self._sender()) for _ in range(self.senders)]
+
+    def register_formatter(self, group, formatter):
+        self.formatters[group] = formatter
+
+    def send(self, chat_id, text=None, group=None, item=None, callback=None, **kwargs):
+        # Must run on the bot loop; returns a future resolved with the sent Message.
+        chat_id = int(chat_id)
+        future = self.loop.create_future()
+        queue = self._queues.setdefault(chat_id, deque())
+        if group is not None:
+            for pending in queue:
+                if pending["group"] == group and pending["attempts"] == 0:
+                    pending["items"].append(item)
+                    pending["futures"].append(future)
+                    if callback:
+                        pending["callbacks"].append(callback)
+                    self.coalesced += 1
+                    return future
+        queue.append({
+            "text": text,
+            "group": group,
+            "items": [item] if group is not None else [],
+            "kwargs": kwargs,
+            "futures": [future],
+            "callbacks": [callback] if callback else [],
+            "queued_at": time.monotonic(),
+            "attempts": 0,
+        })
+        if chat_id not in self._busy:
+            self._ready[chat_id] = None
+        self._wakeup.set()
+        return future
+
+    def send_threadsafe(self, chat_id, text=None, **kwargs):
+        return self.loop.call_soon_threadsafe(lambda: self.send(chat_id, text, **kwargs))
+
+    def queue_depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            "queue_depth": self.queue_depth(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+            "send_latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "send_latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+    def _next_chat(self, now):
+        wait = None
+        if now < self._global_blocked_until:
+            return None, self._global_blocked_until - now
+        for chat_id in self._ready:
+            bucket = self._buckets.setdefault(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+            delay = max(bucket.delay(now), self._blocked_until.get(chat_id, 0) - now)
+            if delay <= 0:
+                del self._ready[chat_id]
+                return chat_id, 0
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    async def _sender(self):
+        while True:
+            try:
+                chat_id, wait = self._next_chat(time.monotonic())
+                if chat_id is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                self._busy.add(chat_id)
+                try:
+                    await self._send_next(chat_id)
+                finally:
+                    self._busy.discard(chat_id)
+                    if self._queues.get(chat_id):
+                        self._ready[chat_id] = None
+                        self._wakeup.set()
+                    else:
+                        self._queues.pop(chat_id, None)
+            except Exception as e:
+                print(f"Outbound dispatcher error: {e}")
+
+    async def _send_next(self, chat_id):
+        entry = self._queues[chat_id][0]
+        delay = self.global_bucket.delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.global_bucket.take()
+        self._buckets[chat_id].take()
+
+        text = entry["text"]
+        if entry["group"] is not None:
+            text = self.formatters[entry["group"]](entry["items"])
+        entry["attempts"] += 1
+
+        try:
+            message = await self.bot.send_message(chat_id=chat_id, text=text, **entry["kwargs"])
+        except RetryAfter as e:
+            self.rate_limited += 1
+            wait = retry_after_seconds(e)
+            print(f"Telegram flood limit for {chat_id}, retrying in {wait:.0f}s")
+            self._blocked_until[chat_id] = time.monotonic() + wait
+            # A 429 usually means the bot as a whole is over the limit, not just this chat.
+            self._global_blocked_until = max(self._global_blocked_until, time.monotonic() + wait)
+            return
+        except BadRequest as e:
+            if entry["kwargs"].get("parse_mode"):
+                # Usually a sender or subject the Markdown parser chokes on; send it as plain text.
+                print(f"Telegram rejected formatted message to {chat_id} ({e}), resending as plain text")
+                entry["kwargs"] = dict(entry["kwargs"], parse_mode=None)
+                return
+            self._drop(chat_id, entry, e)
+            return
+        except Forbidden as e:
+            # Blocked or kicked: no amount of retrying will get this one through.
+            self._drop(chat_id, entry, e)
+            return
+        except Exception as e:
+            if entry["attempts"] < self.max_attempts:
+                self._blocked_until[chat_id] = time.monotonic() + 2 ** entry["attempts"]
+                return
+            self._drop(chat_id, entry, e)
+            return
+
+        self._queues[chat_id].popleft()
+        self._blocked_until.pop(chat_id, None)
+        self.sent += 1
+        latency = time.monotonic() - entry["queued_at"]
+        self.latencies.append(latency)
+        if self.on_sent:
+            self.on_sent(latency)
+        for future in entry["futures"]:
+            if not future.done():
+                future.set_result(message)
+        for callback in entry["callbacks"]:
+            callback(message)
+
+    def _drop(self, chat_id, entry, error):
+        print(f"Dropping message to {chat_id} after {entry['attempts']} attempts: {error}")
+        self._queues[chat_id].popleft()
+        self.failed += 1
+        for future in entry["futures"]:
+            if not future.done():
+                future.set_exception(error)
+                # Fire-and-forget senders never await; don't warn about it.
+                future.exception()
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The bot's modules sit at the repository root rather than in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main opens its account database at import time; keep it out of the working tree.
+TEST_DIR = tempfile.TemporaryDirectory(prefix="otp-tests-")
+os.environ.setdefault("ACCOUNTS_DB", os.path.join(TEST_DIR.name, "accounts.db"))
@@ -0,0 +1,88 @@
+from account_store import AccountStore
+
+CREDS = {"token": "t", "refresh_token": "r", "token_uri": "u", "client_id": "c", "client_secret": "s", "scopes": []}
+
+def make_store(tmp_path):
+    return AccountStore(str(tmp_path / "accounts.db"))
+
+def test_reconnect_from_another_chat_moves_the_chat_index(tmp_path):
+    store = make_store(tmp_path)
+    store.add("x@example.com", 111, CREDS)
+    store.add("x@example.com", 222, CREDS)
+    assert store.get_by_chat_id(111) == (None, None)
+    assert store.get_by_chat_id(222)[0] == "x@example.com"
+
+def test_connecting_another_account_replaces_the_chats_old_one(tmp_path):
+    store = make_store(tmp_path)
+    store.add("a@example.com", 111, CREDS)
+    assert store.add("b@example.com", 111, CREDS) == "a@example.com"
+    assert "a@example.com" not in store
+    assert store.get_by_chat_id(111)[0] == "b@example.com"
+
+def test_reload_picks_up_a_chat_change_made_by_another_process(tmp_path):
+    store = make_store(tmp_path)
+    other = make_store(tmp_path)
+    store.add("x@example.com", 111, CREDS)
+    other.add("x@example.com", 222, CREDS)
+    data, creds = store.reload("x@example.com")
+    assert data["chat_id"] == "222"
+    assert creds == CREDS
+    assert store.get_by_chat_id(111) == (None, None)
+
+def test_dirty_state_survives_a_restart(tmp_path):
+    store = make_store(tmp_path)
+    store.add("x@example.com", 111, CREDS)
+    data = store.get("x@example.com")
+    data["otp_count"] = 3
+    data["history_id"] = "42"
+    data["seen"].add("m1")
+    store.mark_dirty("x@example.com")
+    assert store.flush() == 1
+
+    restored = make_store(tmp_path)
+    assert restored.load() == {"x@example.com": CREDS}
+    data = restored.get("x@example.com")
+    assert (data["otp_count"], data["history_id"]) == (3, "42")
+    assert "m1" in data["seen"]
+
+def test_remove_drops_the_account_and_its_chat(tmp_path):
+    store = make_store(tmp_path)
+    store.add("x@example.com", 111, CREDS)
+    store.remove("x@example.com")
+    assert store.get_by_chat_id(111) == (None, None)
+    assert make_store(tmp_path).load() == {}
+
+def test_refresh_lists_accounts_without_loading_them(tmp_path):
+    worker = make_store(tmp_path)
+    web = make_store(tmp_path)
+    web.add("x@example.com", 111, CREDS)
+    web.add("y@example.com", 222, CREDS)
+    assert worker.refresh() == (["x@example.com", "y@example.com"], [], [])
+    assert len(worker) == 0
+
+def test_refresh_reports_loaded_accounts_reconnected_or_removed_elsewhere(tmp_path):
+    worker = make_store(tmp_path)
+    web = make_store(tmp_path)
+    web.add("x@example.com", 111, CREDS)
+    web.add("y@example.com", 333, CREDS)
+    worker.reload("x@example.com")
+    worker.reload("y@example.com")
+    assert worker.refresh() == (["x@example.com", "y@example.com"], [], [])
+
+    new_creds = dict(CREDS, token="t2")
+    web.add("x@example.com", 222, new_creds)
+    web.remove("y@example.com")
+    assert worker.refresh() == (["x@example.com"], ["y@example.com"], ["x@example.com"])
+    assert "y@example.com" not in worker
+    assert worker.reload("x@example.com")[1] == new_creds
+    assert worker.get_by_chat_id(222)[0] == "x@example.com"
+    assert worker.get_by_chat_id(111) == (None, None)
+    assert worker.refresh() == (["x@example.com"], [], [])
+
+def test_evict_forgets_the_account_but_keeps_its_row(tmp_path):
+    store = make_store(tmp_path)
+    store.add("x@example.com", 111, CREDS)
+    store.evict("x@example.com")
+    assert "x@example.com" not in store
+    assert store.get_by_chat_id(111) == (None, None)
+    assert store.reload("x@example.com")[1] == CREDS
@@ -0,0 +1,16 @@
+from google.auth.exceptions import RefreshError
+
+import main
+from credential_manager import creds_from_dict
+
+CREDS = creds_from_dict({"token": "t", "refresh_token": "r", "token_uri": "u", "client_id": "c", "client_secret": "s", "scopes": []})
+
+def test_reconnecting_clears_the_accounts_open_circuit():
+    email = "reconnect@example.com"
+    main.connect_account(email, 111, CREDS)
+    for _ in range(main.QUOTA.auth_threshold):
+        main.QUOTA.record_failure(email, RefreshError("invalid_grant"))
+    assert main.QUOTA.wait_time(email) > 0
+
+    main.connect_account(email, 111, CREDS)
+    assert main.QUOTA.wait_time(email) == 0
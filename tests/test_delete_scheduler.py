@@ -0,0 +1,16 @@
+from delete_scheduler import DeleteScheduler
+
+def test_journal_replay_keeps_only_pending_deletes(tmp_path):
+    journal = tmp_path / "pending_deletes.log"
+    journal.write_text(
+        "+ 100.000 1 10\n"
+        "+ 200.000 1 11\n"
+        "- 1 10\n"
+        "+ 300.000 2 12\n"
+        "+ 400.0"  # torn by a crash mid-write
+    )
+    scheduler = DeleteScheduler(bot=None, journal_path=str(journal))
+    assert scheduler.load() == 2
+    assert sorted(scheduler._heap) == [(200.0, 1, 11), (300.0, 2, 12)]
+    # Replay compacts the journal down to what is still pending.
+    assert journal.read_text().splitlines() == ["+ 200.000 1 11", "+ 300.000 2 12"]
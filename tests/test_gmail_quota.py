@@ -0,0 +1,51 @@
+import pytest
+from google.auth.exceptions import RefreshError
+
+from gmail_quota import GmailQuota, GmailUnavailable
+
+def open_circuit(quota, email):
+    for _ in range(quota.auth_threshold):
+        quota.record_failure(email, RefreshError("invalid_grant"))
+
+def expire(quota, email):
+    # Jump past the open period so the next call is the probe.
+    state = quota._state[email]
+    state["open_until"] = state["retry_at"] = 0.0
+
+def test_repeated_auth_errors_open_the_circuit():
+    quota = GmailQuota(open_seconds=300)
+    open_circuit(quota, "a")
+    assert quota.paused_counts()["circuit_open"] == 1
+    with pytest.raises(GmailUnavailable):
+        quota.acquire("a", "gmail.users.messages.list")
+
+def test_failed_probe_reopens_the_circuit_for_twice_as_long():
+    quota = GmailQuota(open_seconds=300)
+    open_circuit(quota, "a")
+    expire(quota, "a")
+    quota.record_failure("a", RefreshError("invalid_grant"))
+    assert quota.paused_counts()["circuit_open"] == 1
+    assert quota.wait_time("a") == pytest.approx(600, abs=1)
+    assert quota.circuits_opened == 2
+
+def test_successful_probe_closes_the_circuit():
+    quota = GmailQuota(open_seconds=300)
+    open_circuit(quota, "a")
+    expire(quota, "a")
+    quota.record_success("a")
+    quota.record_failure("a", RefreshError("invalid_grant"))
+    # Back to counting from scratch: one failure only backs off.
+    assert quota.paused_counts() == {"backoff": 1, "circuit_open": 0}
+
+def test_failures_in_flight_while_open_dont_extend_it():
+    quota = GmailQuota(open_seconds=300)
+    open_circuit(quota, "a")
+    quota.record_failure("a", RefreshError("invalid_grant"))
+    assert quota.wait_time("a") == pytest.approx(300, abs=1)
+    assert quota.circuits_opened == 1
+
+def test_quota_waits_longer_than_max_wait_are_refused():
+    quota = GmailQuota(user_rate=10, max_wait=0.5)
+    quota.acquire("a", "gmail.users.messages.get", count=2)
+    with pytest.raises(GmailUnavailable):
+        quota.acquire("a", "gmail.users.messages.get", count=2)
@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+
+import main
+
+class StubRequest:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+class StubUsers:
+    def __init__(self):
+        self.stopped = []
+
+    def watch(self, userId, body):
+        return StubRequest({"historyId": "900", "expiration": "4102444800000"})
+
+    def stop(self, userId):
+        self.stopped.append(userId)
+        return StubRequest({})
+
+class StubService:
+    def __init__(self):
+        self._users = StubUsers()
+
+    def users(self):
+        return self._users
+
+def test_watch_registration_leaves_the_history_cursor_to_the_first_poll():
+    # A new account has no cursor yet; taking the watch's would skip its full sync.
+    data = {}
+    main.ensure_watch("new@example.com", StubService(), data)
+    assert data["watch_expiration"] == 4102444800000
+    assert "history_id" not in data
+
+def test_disconnecting_stops_the_watch(monkeypatch):
+    service = StubService()
+
+    @contextmanager
+    def gmail_service(email):
+        yield service
+
+    monkeypatch.setattr(main, "GMAIL_PUSH_TOPIC", "projects/p/topics/t")
+    monkeypatch.setattr(main, "gmail_service", gmail_service)
+    main.disconnect_account("gone@example.com")
+    assert service.users().stopped == ["me"]
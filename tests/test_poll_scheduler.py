@@ -0,0 +1,44 @@
+import time
+
+from poll_scheduler import PollScheduler
+
+def test_idle_polls_back_off_up_to_the_max():
+    scheduler = PollScheduler(base_interval=10, max_interval=20, backoff=1.5)
+    scheduler.add("a", delay=0)
+    for _ in range(5):
+        scheduler.record("a", activity=False)
+    assert scheduler.export()["a"][1] == 20
+    scheduler.record("a", activity=True)
+    assert scheduler.export()["a"][1] == 10
+
+def test_boost_makes_the_account_hot_and_due_now():
+    scheduler = PollScheduler(base_interval=10, hot_interval=3, hot_duration=60)
+    scheduler.add("a", delay=100)
+    scheduler.boost("a")
+    assert [email for email, _ in scheduler.pop_due()] == ["a"]
+    assert scheduler.tiers()["hot"] == 1
+
+def test_rescheduling_leaves_no_stale_entry_behind():
+    scheduler = PollScheduler(base_interval=10)
+    scheduler.add("a", delay=0)
+    scheduler.defer("a", 100)
+    assert scheduler.pop_due(now=time.monotonic() + 1) == []
+
+def test_removed_accounts_are_not_returned():
+    scheduler = PollScheduler(base_interval=10)
+    scheduler.add("a", delay=0)
+    scheduler.remove("a")
+    assert scheduler.pop_due(now=time.monotonic() + 1) == []
+
+def test_export_and_restore_keep_tier_and_due_time():
+    scheduler = PollScheduler(base_interval=10, hot_interval=3, hot_duration=60)
+    scheduler.add("a", delay=50)
+    scheduler.add("b", delay=0)
+    scheduler.boost("b")
+    saved = scheduler.export()
+
+    restored = PollScheduler(base_interval=10, hot_interval=3, hot_duration=60)
+    for email, (due_in, interval, hot_for) in saved.items():
+        restored.restore(email, due_in, interval, hot_for)
+    assert restored.tiers() == {"hot": 1, "warm": 1, "cold": 0}
+    assert [email for email, _ in restored.pop_due()] == ["b"]
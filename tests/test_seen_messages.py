@@ -0,0 +1,18 @@
+import time
+
+from seen_messages import SeenMessages
+
+def test_ids_are_dropped_once_their_bucket_leaves_the_window():
+    now = time.time()
+    seen = SeenMessages(window_seconds=600, bucket_seconds=300)
+    seen.add("old", (now - 500) * 1000)
+    seen.add("new", now * 1000)
+    seen.prune(now=now + 400)
+    assert "old" not in seen
+    assert "new" in seen
+
+def test_round_trips_through_a_list():
+    seen = SeenMessages()
+    seen.add("m1")
+    restored = SeenMessages.from_list(seen.to_list())
+    assert "m1" in restored and len(restored) == 1
@@ -0,0 +1,38 @@
+from shard_leases import ShardLeases
+
+def make_leases(tmp_path, worker_id):
+    return ShardLeases(str(tmp_path / "accounts.db"), worker_id, shard_count=8, lease_seconds=15)
+
+def test_lone_worker_claims_every_shard(tmp_path):
+    a = make_leases(tmp_path, "a")
+    assert a.heartbeat(100) == set(range(8))
+
+def test_workers_split_shards_by_fair_share(tmp_path):
+    a = make_leases(tmp_path, "a")
+    b = make_leases(tmp_path, "b")
+    a.heartbeat(100)
+    # a's leases are still live, so b has nothing to claim until a hands some back.
+    assert b.heartbeat(101) == set()
+    assert a.heartbeat(102) == {0, 1, 2, 3}
+    assert b.heartbeat(103) == {4, 5, 6, 7}
+    assert a.heartbeat(104) == {0, 1, 2, 3}
+
+def test_worker_claims_only_up_to_its_fair_share(tmp_path):
+    a = make_leases(tmp_path, "a")
+    b = make_leases(tmp_path, "b")
+    a.heartbeat(100)
+    b.heartbeat(101)
+    a.heartbeat(102)
+    # A third worker finds four shards free but only takes ceil(8 / 3) of them.
+    c = make_leases(tmp_path, "c")
+    assert c.heartbeat(103) == {4, 5, 6}
+
+def test_expired_leases_are_taken_over(tmp_path):
+    a = make_leases(tmp_path, "a")
+    b = make_leases(tmp_path, "b")
+    a.heartbeat(100)
+    b.heartbeat(101)
+    # a dies and stops renewing; once its leases run out b picks them all up.
+    assert b.heartbeat(110) == set()
+    assert b.heartbeat(116) == set(range(8))
+    assert a.heartbeat(117) == set()
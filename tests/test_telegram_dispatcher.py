@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from telegram_dispatcher import OutboundDispatcher, TokenBucket
+
+class StubBot:
+    # Raises the given errors in order, then accepts every send.
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((chat_id, text, kwargs))
+        return len(self.sent)
+
+def make_dispatcher(bot, **kwargs):
+    dispatcher = OutboundDispatcher(bot, asyncio.get_running_loop(), **kwargs)
+    dispatcher.register_formatter("otp", lambda items: ",".join(items))
+    return dispatcher
+
+async def send_next(dispatcher, chat_id):
+    # Normally the sender tasks pick the chat (creating its bucket) first.
+    dispatcher._buckets.setdefault(chat_id, TokenBucket(100, 100))
+    await dispatcher._send_next(chat_id)
+
+def test_items_queued_for_the_same_group_go_out_as_one_message():
+    async def scenario():
+        bot = StubBot()
+        dispatcher = make_dispatcher(bot)
+        futures = [dispatcher.send(1, group="otp", item=otp) for otp in ("111", "222", "333")]
+        await send_next(dispatcher, 1)
+        assert bot.sent == [(1, "111,222,333", {})]
+        assert dispatcher.coalesced == 2
+        assert [future.result() for future in futures] == [1, 1, 1]
+    asyncio.run(scenario())
+
+def test_flood_limit_blocks_the_chat_and_keeps_the_message_queued():
+    async def scenario():
+        bot = StubBot(RetryAfter(30))
+        dispatcher = make_dispatcher(bot)
+        future = dispatcher.send(1, "hello")
+        await send_next(dispatcher, 1)
+        assert not future.done()
+        assert dispatcher.rate_limited == 1
+        assert dispatcher.queue_depth() == 1
+        chat_id, wait = dispatcher._next_chat(time.monotonic())
+        assert chat_id is None and wait == pytest.approx(30, abs=1)
+
+        await send_next(dispatcher, 1)
+        assert future.result() == 1
+        assert dispatcher.queue_depth() == 0
+    asyncio.run(scenario())
+
+def test_message_is_dropped_after_max_attempts():
+    async def scenario():
+        bot = StubBot(*[TimeoutError("slow")] * 3)
+        dispatcher = make_dispatcher(bot, max_attempts=3)
+        future = dispatcher.send(1, "hello")
+        for _ in range(3):
+            await send_next(dispatcher, 1)
+        assert isinstance(future.exception(), TimeoutError)
+        assert dispatcher.failed == 1
+        assert dispatcher.queue_depth() == 0
+        assert bot.sent == []
+    asyncio.run(scenario())
+
+def test_bad_markdown_is_resent_once_as_plain_text():
+    async def scenario():
+        bot = StubBot(BadRequest("Can't parse entities"))
+        dispatcher = make_dispatcher(bot)
+        future = dispatcher.send(1, "a_b", parse_mode="Markdown")
+        await send_next(dispatcher, 1)
+        await send_next(dispatcher, 1)
+        assert future.result() == 1
+        assert bot.sent == [(1, "a_b", {"parse_mode": None})]
+    asyncio.run(scenario())
+
+def test_blocked_chat_is_dropped_without_retrying():
+    async def scenario():
+        bot = StubBot(Forbidden("bot was blocked by the user"))
+        dispatcher = make_dispatcher(bot)
+        future = dispatcher.send(1, "hello")
+        await send_next(dispatcher, 1)
+        assert isinstance(future.exception(), Forbidden)
+        assert dispatcher.failed == 1
+        assert dispatcher.queue_depth() == 0
+    asyncio.run(scenario())
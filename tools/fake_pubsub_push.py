@@ -0,0 +1,46 @@
+import argparse
+import base64
+import json
+import time
+import uuid
+
+import requests
+
+# Stand-in for a Pub/Sub push subscription: posts Gmail watch notifications
+# to the bot's /gmail/push route the same way Google would.
+
+def envelope(email, history_id, subscription):
+    data = json.dumps({"emailAddress": email, "historyId": history_id}).encode("utf-8")
+    return {
+        "message": {
+            "data": base64.b64encode(data).decode("ascii"),
+            "messageId": uuid.uuid4().hex,
+            "publishTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "subscription": subscription,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Post fake Gmail Pub/Sub push notifications")
+    parser.add_argument("email", nargs="+", help="Gmail address(es) to notify for")
+    parser.add_argument("--url", default="http://localhost:5000/gmail/push")
+    parser.add_argument("--token", help="value for ?token= (PUSH_VERIFICATION_TOKEN)")
+    parser.add_argument("--history-id", type=int, default=1)
+    parser.add_argument("--count", type=int, default=1, help="notifications per address")
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between rounds")
+    parser.add_argument("--subscription", default="projects/local/subscriptions/gmail-push")
+    args = parser.parse_args()
+
+    params = {"token": args.token} if args.token else {}
+    for round_number in range(args.count):
+        for email in args.email:
+            history_id = args.history_id + round_number
+            started = time.perf_counter()
+            response = requests.post(args.url, params=params, json=envelope(email, history_id, args.subscription))
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            print(f"{email} historyId={history_id} -> {response.status_code} in {elapsed_ms:.1f} ms")
+        if args.interval and round_number + 1 < args.count:
+            time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class Tracer:
+    # Per-poll trace spans, kept only when a trace runs longer than slow_seconds.
+    # Spans opened on a thread with no trace running (or with tracing off) cost
+    # one attribute lookup and are dropped.
+    def __init__(self, slow_seconds=None, keep=50):
+        self.slow_seconds = slow_seconds
+        self.slow_traces = deque(maxlen=keep)
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return self.slow_seconds is not None
+
+    @contextmanager
+    def trace(self, name, **attrs):
+        if not self.enabled or getattr(self._local, "stack", None):
+            yield
+            return
+        root = {"name": name, "attrs": attrs, "start": time.monotonic(), "spans": []}
+        self._local.stack = [root]
+        try:
+            yield
+        finally:
+            self._local.stack = None
+            root["duration"] = time.monotonic() - root["start"]
+            if root["duration"] >= self.slow_seconds:
+                trace = self._export(root, root["start"])
+                trace["at"] = time.time()
+                self.slow_traces.append(trace)
+                print(f"🐢 Slow {name} {' '.join(f'{k}={v}' for k, v in attrs.items())} "
+                      f"{root['duration']:.2f}s: {self.summary(trace)}")
+
+    @contextmanager
+    def span(self, name, **attrs):
+        stack = getattr(self._local, "stack", None)
+        if not stack:
+            yield
+            return
+        span = {"name": name, "attrs": attrs, "start": time.monotonic(), "spans": []}
+        stack[-1]["spans"].append(span)
+        stack.append(span)
+        try:
+            yield
+        except Exception as e:
+            span["attrs"]["error"] = type(e).__name__
+            raise
+        finally:
+            span["duration"] = time.monotonic() - span["start"]
+            stack.pop()
+
+    def _export(self, span, origin):
+        return {
+            "name": span["name"],
+            "attrs": span["attrs"],
+            "offset": round(span["start"] - origin, 4),
+            "duration": round(span.get("duration", 0.0), 4),
+            "spans": [self._export(child, origin) for child in span["spans"]],
+        }
+
+    def summary(self, trace):
+        return " | ".join(
+            f"{'›' * depth}{span['name']} {span['duration']:.2f}s"
+            for depth, span in self._walk(trace["spans"], 0)
+        )
+
+    def _walk(self, spans, depth):
+        for span in spans:
+            yield depth, span
+            yield from self._walk(span["spans"], depth + 1)
+
+    def recent(self):
+        return list(self.slow_traces)